@@ -1,37 +1,52 @@
 from fastapi import FastAPI, HTTPException, Request
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.job import Job
 from datetime import datetime
+import os
 import pytz
 import uvicorn
-import requests
+from jobstore import SQLiteJobStore
+from dispatcher import Dispatcher
+from scheduling import CRON_LEAD_SECONDS, CRON_SPREAD_SECONDS, dispatch_time
 
 app = FastAPI()
 
+# How late a job may still fire, e.g. when many are due in the same second
+MISFIRE_GRACE_SECONDS = int(os.getenv("MISFIRE_GRACE_SECONDS", "60"))
+# A task that fires again this soon after it was dispatched is a duplicate: an
+# event edited during its lead window is re-scheduled after its bot was sent
+DEDUP_WINDOW_SECONDS = int(os.getenv(
+    "DEDUP_WINDOW_SECONDS", str(CRON_LEAD_SECONDS + CRON_SPREAD_SECONDS + MISFIRE_GRACE_SECONDS)
+))
+
 # Configure the job store to use a database
 jobstores = {
-    'default': SQLAlchemyJobStore(url='sqlite:///jobs.sqlite')
+    'default': SQLiteJobStore('jobs.sqlite')
 }
-scheduler = BackgroundScheduler(jobstores=jobstores)
-scheduler.start()
+scheduler = BackgroundScheduler(jobstores=jobstores, job_defaults={'misfire_grace_time': MISFIRE_GRACE_SECONDS})
+dispatcher = Dispatcher()
 
 def execute_task(task_id, link, headers, body):
-    try:
-        response = requests.post(link, headers=headers, json=body)
-        print(f"Executed task with response: {response.status_code} - {response.text}")
-    except Exception as e:
-        print(f"Error executing task: {e}")
-    finally:
-        # Remove the task from the scheduler after execution
-        try:
-            scheduler.remove_job(task_id)
-            print(f"Task {task_id} deleted from scheduler after execution.")
-        except Exception as e:
-            print(f"Error deleting task {task_id}: {e}")
+    if not dispatcher.claim(task_id, DEDUP_WINDOW_SECONDS):
+        print(f"Task {task_id} was already dispatched in the last {DEDUP_WINDOW_SECONDS}s; skipping")
+        return
+    # Hand the webhook to the dispatcher and free the scheduler thread at once.
+    # Date-triggered jobs are removed from the store by the scheduler once fired.
+    dispatcher.submit(task_id, link, headers, body)
 
-@app.post('/schedule-task')
-async def schedule_task(request: Request):
-    data = await request.json()
+# Started once execute_task exists, since stored jobs refer to it
+dispatcher.start()
+scheduler.start()
+
+def parse_task(data):
+    """
+    Validate a task payload and return (task_id, dispatch_time, link, headers, body).
+
+    Tasks fire lead_seconds plus a per-task share of spread_seconds before
+    their run_time; both default to CRON_LEAD_SECONDS and CRON_SPREAD_SECONDS
+    and can be set per task, e.g. to 0 for tasks that must fire on time.
+    """
     task_id = data.get('task_id')
     run_time = data.get('run_time')  # Expected format: 'YYYY-MM-DD HH:MM:SS'
     link = data.get('link')
@@ -48,18 +63,75 @@ async def schedule_task(request: Request):
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid run_time format. Use 'YYYY-MM-DD HH:MM:SS'")
 
-    # Check if the task already exists
-    existing_job = scheduler.get_job(task_id)
-    if existing_job:
-        # Remove the existing task
-        scheduler.remove_job(task_id)
-        print(f"Task {task_id} removed for rescheduling.")
+    try:
+        lead_seconds = int(data.get('lead_seconds', CRON_LEAD_SECONDS))
+        spread_seconds = int(data.get('spread_seconds', CRON_SPREAD_SECONDS))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="lead_seconds and spread_seconds must be integers")
+    if lead_seconds < 0 or spread_seconds < 0:
+        raise HTTPException(status_code=400, detail="lead_seconds and spread_seconds must not be negative")
+
+    fire_time = dispatch_time(task_id, run_time, lead_seconds, spread_seconds)
+    now = datetime.now(pytz.utc)
+    if fire_time < now < run_time:
+        # Scheduled inside its lead window: fire right away rather than as a misfire
+        fire_time = now
+
+    return task_id, fire_time, link, headers, body
+
+def build_job(task_id, run_time, link, headers, body):
+    """The scheduler job that fires execute_task for a parsed task at run_time."""
+    return Job(
+        scheduler,
+        id=task_id,
+        name=execute_task.__name__,
+        func=execute_task,
+        args=[task_id, link, headers, body],
+        kwargs={},
+        trigger=DateTrigger(run_date=run_time),
+        executor='default',
+        misfire_grace_time=MISFIRE_GRACE_SECONDS,
+        coalesce=True,
+        max_instances=1,
+        next_run_time=run_time
+    )
 
-    # Schedule the task
-    scheduler.add_job(execute_task, 'date', run_date=run_time, args=[task_id, link, headers, body], id=task_id)
+@app.post('/schedule-task')
+async def schedule_task(request: Request):
+    data = await request.json()
+    task_id, run_time, link, headers, body = parse_task(data)
+
+    # One upsert replaces any existing task; an identical one is left alone
+    if not jobstores['default'].upsert_jobs([build_job(task_id, run_time, link, headers, body)]):
+        return {"status": "Task unchanged", "task_id": task_id}
+    scheduler.wakeup()
     print(f"Task {task_id} scheduled with details: run_time={run_time}, link={link}, headers={headers}, body={body}")
     return {"status": "Task scheduled", "task_id": task_id}
 
+@app.post('/schedule-tasks')
+async def schedule_tasks(request: Request):
+    data = await request.json()
+    tasks = data.get('tasks') if isinstance(data, dict) else data
+    if not isinstance(tasks, list):
+        raise HTTPException(status_code=400, detail="tasks must be a list")
+
+    # Validate the whole batch before writing anything
+    parsed = {}
+    for index, task in enumerate(tasks):
+        try:
+            task = parse_task(task)
+        except HTTPException as e:
+            raise HTTPException(status_code=400, detail=f"tasks[{index}]: {e.detail}")
+        # A later entry for the same id wins, as it would with repeated /schedule-task calls
+        parsed[task[0]] = build_job(*task)
+
+    # One transaction for the whole batch, then let the scheduler pick up the new run times
+    written = jobstores['default'].upsert_jobs(list(parsed.values()))
+    if written:
+        scheduler.wakeup()
+    print(f"Scheduled {len(written)} tasks in one batch, {len(parsed) - len(written)} unchanged")
+    return {"status": "Tasks scheduled", "task_ids": written, "unchanged": len(parsed) - len(written)}
+
 @app.delete('/delete-task')
 async def delete_task(task_id: str):
     if not task_id:
@@ -71,5 +143,36 @@ async def delete_task(task_id: str):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.post('/delete-tasks')
+async def delete_tasks(request: Request):
+    data = await request.json()
+    task_ids = data.get('task_ids') if isinstance(data, dict) else data
+    if not isinstance(task_ids, list):
+        raise HTTPException(status_code=400, detail="task_ids must be a list")
+
+    # One transaction for the whole batch; ids that don't exist are ignored
+    deleted = jobstores['default'].remove_jobs(task_ids)
+    print(f"Deleted {len(deleted)} of {len(task_ids)} tasks in one batch")
+    return {"status": "Tasks deleted", "task_ids": deleted}
+
+@app.get('/metrics')
+async def metrics():
+    return {"dispatcher": dispatcher.stats()}
+
+@app.get('/dead-letters')
+async def dead_letters(limit: int = 100):
+    return {"dead_letters": dispatcher.dead_letters(limit)}
+
+@app.post('/dead-letters/{task_id}/redeliver')
+async def redeliver_dead_letter(task_id: str):
+    if not dispatcher.redeliver(task_id):
+        raise HTTPException(status_code=404, detail="No dead letter for this task_id")
+    return {"status": "Task redelivered", "task_id": task_id}
+
+@app.on_event('shutdown')
+def shutdown():
+    scheduler.shutdown(wait=False)
+    dispatcher.close()
+
 if __name__ == '__main__':
     uvicorn.run(app, host="0.0.0.0", port=8050)
@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import aiohttp
+
+# Webhooks in flight at once; also the connection pool size
+DISPATCH_CONCURRENCY = int(os.getenv("DISPATCH_CONCURRENCY", "200"))
+# Targets only have to accept the job (/join-meet answers 202 right away), so
+# connecting and acknowledging should both be quick
+DISPATCH_CONNECT_TIMEOUT_SECONDS = float(os.getenv("DISPATCH_CONNECT_TIMEOUT_SECONDS", "3"))
+DISPATCH_ACK_TIMEOUT_SECONDS = float(os.getenv("DISPATCH_ACK_TIMEOUT_SECONDS", "10"))
+# Retries after the first attempt, with exponential backoff and jitter
+DISPATCH_RETRIES = int(os.getenv("DISPATCH_RETRIES", "4"))
+DISPATCH_BACKOFF_SECONDS = float(os.getenv("DISPATCH_BACKOFF_SECONDS", "1"))
+# Where webhooks that ran out of retries, and recent dispatches, are kept; a
+# file of its own so dispatches don't contend with the job store's writes
+DISPATCH_DB_PATH = os.getenv("DISPATCH_DB_PATH", "dispatch.sqlite")
+# How long a write waits for another connection's lock before failing
+DISPATCH_DB_BUSY_TIMEOUT_SECONDS = float(os.getenv("DISPATCH_DB_BUSY_TIMEOUT_SECONDS", "5"))
+# Dispatch records older than this are pruned on start
+DISPATCH_HISTORY_SECONDS = 7 * 24 * 3600
+
+
+class Dispatcher:
+    """
+    Sends job webhooks from a dedicated event loop with one pooled aiohttp session.
+
+    `submit` is called from APScheduler's worker threads and returns at once,
+    so a fired job holds a scheduler thread for microseconds instead of for
+    the length of the request. At most `concurrency` requests are in flight.
+    Connection errors, timeouts, 429 and 5xx responses are retried with
+    exponential backoff; other 4xx responses and exhausted retries go to the
+    `dead_letters` table, from which they can be listed and redelivered.
+    """
+
+    def __init__(self, concurrency=DISPATCH_CONCURRENCY, connect_timeout=DISPATCH_CONNECT_TIMEOUT_SECONDS,
+                 ack_timeout=DISPATCH_ACK_TIMEOUT_SECONDS, retries=DISPATCH_RETRIES,
+                 backoff=DISPATCH_BACKOFF_SECONDS, db_path=DISPATCH_DB_PATH):
+        self.concurrency = concurrency
+        self.timeout = aiohttp.ClientTimeout(total=ack_timeout, connect=connect_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.db_path = db_path
+        self._loop = None
+        self._session = None
+        self._semaphore = None
+        self._counters = {"submitted": 0, "delivered": 0, "retried": 0, "dead_lettered": 0, "in_flight": 0,
+                          "duplicates_skipped": 0}
+        self._latency = {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        self._init_db()
+
+    def start(self):
+        if self._loop is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="dispatcher", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._open(), self._loop).result()
+
+    def close(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+
+    def submit(self, task_id, link, headers, body, due=None):
+        """Queue a webhook; returns a concurrent.futures.Future resolving to True once delivered."""
+        return asyncio.run_coroutine_threadsafe(self._deliver(task_id, link, headers, body, due or time.time()), self._loop)
+
+    def claim(self, task_id, window):
+        """
+        Record that task_id is being dispatched now.
+
+        Returns False, recording nothing, if it was already dispatched within
+        the last `window` seconds; the caller should then skip it. If the
+        record cannot be written it returns True: a possible duplicate join
+        is better than a missed meeting.
+        """
+        now = time.time()
+        try:
+            with self._connect() as connection:
+                cursor = connection.execute(
+                    "INSERT INTO dispatched (task_id, dispatched_at) VALUES (?, ?) "
+                    "ON CONFLICT (task_id) DO UPDATE SET dispatched_at = excluded.dispatched_at "
+                    "WHERE dispatched_at < ?",
+                    (task_id, now, now - window)
+                )
+        except sqlite3.OperationalError as e:
+            print(f"Could not record dispatch of task {task_id}, dispatching anyway: {e}")
+            return True
+        if cursor.rowcount == 0:
+            self._counters["duplicates_skipped"] += 1
+            return False
+        return True
+
+    def dead_letters(self, limit=100):
+        with self._connect() as connection:
+            connection.row_factory = sqlite3.Row
+            rows = connection.execute(
+                "SELECT * FROM dead_letters ORDER BY failed_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [
+            {**dict(row), "headers": json.loads(row["headers"]), "body": json.loads(row["body"])}
+            for row in rows
+        ]
+
+    def redeliver(self, task_id):
+        """Submit a dead-lettered webhook again; returns False if there is none."""
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT link, headers, body FROM dead_letters WHERE task_id = ?", (task_id,)
+            ).fetchone()
+            if row is None:
+                return False
+            connection.execute("DELETE FROM dead_letters WHERE task_id = ?", (task_id,))
+        self.submit(task_id, row[0], json.loads(row[1]), json.loads(row[2]))
+        return True
+
+    def stats(self):
+        latency = self._latency
+        return {
+            **self._counters,
+            "concurrency": self.concurrency,
+            # Seconds from submission (or the given due time) to acknowledgement
+            "avg_delay_seconds": round(latency["total_seconds"] / latency["count"], 3) if latency["count"] else None,
+            "max_delay_seconds": round(latency["max_seconds"], 3)
+        }
+
+    async def _open(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def _deliver(self, task_id, link, headers, body, due):
+        self._counters["submitted"] += 1
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._counters["retried"] += 1
+                # 1x, 2x, 4x ... the base backoff, jittered so retries don't arrive in lockstep
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+            # The slot is only held for the request itself, not for the backoff
+            async with self._semaphore:
+                self._counters["in_flight"] += 1
+                try:
+                    async with self._session.post(link, headers=headers, json=body) as response:
+                        text = await response.text()
+                    if response.status < 400:
+                        self._record_delay(time.time() - due)
+                        self._counters["delivered"] += 1
+                        print(f"Executed task {task_id} with response: {response.status} - {text[:200]}")
+                        return True
+                    error = f"{response.status} {text[:500]}"
+                    retryable = response.status == 429 or response.status >= 500
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = f"{type(e).__name__}: {e}"
+                    retryable = True
+                finally:
+                    self._counters["in_flight"] -= 1
+
+            print(f"Task {task_id} attempt {attempt + 1} failed: {error}")
+            if not retryable:
+                break
+
+        self._counters["dead_lettered"] += 1
+        await asyncio.to_thread(self._dead_letter, task_id, link, headers, body, attempt + 1, error)
+        return False
+
+    def _dead_letter(self, task_id, link, headers, body, attempts, error):
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO dead_letters (task_id, link, headers, body, attempts, last_error, failed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (task_id, link, json.dumps(headers), json.dumps(body), attempts, error, time.time())
+            )
+        print(f"Task {task_id} dead-lettered after {attempts} attempts: {error}")
+
+    def _record_delay(self, seconds):
+        self._latency["count"] += 1
+        self._latency["total_seconds"] += seconds
+        self._latency["max_seconds"] = max(self._latency["max_seconds"], seconds)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=DISPATCH_DB_BUSY_TIMEOUT_SECONDS)
+
+    def _init_db(self):
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letters ("
+                "task_id TEXT PRIMARY KEY, link TEXT NOT NULL, headers TEXT NOT NULL, body TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL, last_error TEXT, failed_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS dispatched (task_id TEXT PRIMARY KEY, dispatched_at REAL NOT NULL)"
+            )
+            connection.execute("DELETE FROM dispatched WHERE dispatched_at < ?", (time.time() - DISPATCH_HISTORY_SECONDS,))
+
+
+def benchmark(jobs=5000, ack_ms=50, failure_rate=0.02, concurrency=DISPATCH_CONCURRENCY):
+    """Dispatch `jobs` webhooks due at the same instant to a local server that acks in `ack_ms`."""
+    from aiohttp import web
+
+    async def join(request):
+        await request.read()
+        await asyncio.sleep(ack_ms / 1000)
+        if random.random() < failure_rate:
+            return web.Response(status=503, text="busy")
+        return web.json_response({"status": "queued"}, status=202)
+
+    async def serve(ready):
+        app = web.Application()
+        app.router.add_post("/join-meet", join)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        ready.append(site._server.sockets[0].getsockname()[1])
+
+    server_loop = asyncio.new_event_loop()
+    threading.Thread(target=server_loop.run_forever, daemon=True).start()
+    ready = []
+    asyncio.run_coroutine_threadsafe(serve(ready), server_loop).result()
+    link = f"http://127.0.0.1:{ready[0]}/join-meet"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dispatcher = Dispatcher(concurrency=concurrency, backoff=0.05, db_path=os.path.join(tmp, "dead.sqlite"))
+        dispatcher.start()
+        start = time.time()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            futures = [dispatcher.submit(f"task{i}", link, {}, {"meet_link": "x", "end_time": 60}, due=start)
+                       for i in range(jobs)]
+            delivered = sum(future.result() for future in futures)
+        elapsed = time.time() - start
+        dispatcher.close()
+
+    stats = dispatcher.stats()
+    print(f"{jobs} jobs due at once, {ack_ms}ms ack, {failure_rate:.0%} transient failures, concurrency {concurrency}")
+    print(f"delivered {delivered} in {elapsed:.2f}s ({jobs / elapsed:.0f}/s), {stats['retried']} retries, "
+          f"{stats['dead_lettered']} dead-lettered, max delay {stats['max_delay_seconds']}s")
+    # The previous blocking requests.post on APScheduler's 10 default threads
+    print(f"blocking executor (10 threads): ~{jobs * ack_ms / 1000 / 10:.1f}s with instant acks, "
+          f"and a thread held for the whole meeting when the target holds the request")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark webhook dispatch for a burst of due jobs")
+    arg_parser.add_argument("--jobs", type=int, default=5000, help="jobs due at the same instant")
+    arg_parser.add_argument("--ack-ms", type=int, default=50, help="time the target takes to acknowledge")
+    arg_parser.add_argument("--failure-rate", type=float, default=0.02, help="share of 503 responses")
+    arg_parser.add_argument("--concurrency", type=int, default=DISPATCH_CONCURRENCY, help="webhooks in flight")
+    args = arg_parser.parse_args()
+    benchmark(args.jobs, args.ack_ms, args.failure_rate, args.concurrency)
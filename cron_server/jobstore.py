@@ -0,0 +1,356 @@
+import argparse
+import base64
+import json
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.util import datetime_to_utc_timestamp, ref_to_obj, utc_timestamp_to_datetime
+import pytz
+
+# Ids per statement in batched reads and deletes, under SQLite's variable limit
+BATCH_SIZE = 500
+
+
+class SQLiteJobStore(BaseJobStore):
+    """
+    APScheduler job store on a single WAL-mode SQLite connection.
+
+    Rows are (id, next_run_time, job) with an index on next_run_time, so
+    finding due jobs and the next wakeup only touches the jobs that matter.
+    Jobs are stored as compact JSON rather than pickles: date-triggered jobs
+    keep their run date and only the settings that differ from the defaults
+    used by this server; other triggers are kept pickled inside the JSON.
+    `upsert_jobs` and `remove_jobs` write a whole batch in one transaction.
+
+    Jobs left in an `apscheduler_jobs` table by SQLAlchemyJobStore are
+    imported on start.
+    """
+
+    def __init__(self, path="jobs.sqlite", tablename="scheduled_jobs"):
+        super().__init__()
+        self.path = path
+        self.tablename = tablename
+        self._connection = None
+        self._lock = threading.Lock()
+        # func ref -> callable, resolved once per store
+        self._funcs = {}
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        # Autocommit mode; multi-statement writes open their own transaction
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only syncs at checkpoints: a power cut can lose the
+        # last writes but never corrupts the database
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.tablename} (id TEXT PRIMARY KEY, next_run_time REAL, job TEXT NOT NULL)"
+        )
+        self._connection.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.tablename}_next_run_time ON {self.tablename} (next_run_time)"
+        )
+        self._import_sqlalchemy_jobs()
+
+    def shutdown(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def lookup_job(self, job_id):
+        rows = self._query(f"SELECT id, next_run_time, job FROM {self.tablename} WHERE id = ?", (job_id,))
+        return self._reconstitute_job(*rows[0]) if rows else None
+
+    def get_due_jobs(self, now):
+        return self._get_jobs("WHERE next_run_time <= ?", (datetime_to_utc_timestamp(now),))
+
+    def get_next_run_time(self):
+        rows = self._query(f"SELECT MIN(next_run_time) FROM {self.tablename}")
+        return utc_timestamp_to_datetime(rows[0][0])
+
+    def get_all_jobs(self):
+        jobs = self._get_jobs()
+        self._fix_paused_jobs_sorting(jobs)
+        return jobs
+
+    def add_job(self, job):
+        try:
+            with self._lock:
+                self._connection.execute(
+                    f"INSERT INTO {self.tablename} (id, next_run_time, job) VALUES (?, ?, ?)", self._row(job)
+                )
+        except sqlite3.IntegrityError:
+            raise ConflictingIdError(job.id)
+
+    def update_job(self, job):
+        job_id, next_run_time, data = self._row(job)
+        with self._lock:
+            cursor = self._connection.execute(
+                f"UPDATE {self.tablename} SET next_run_time = ?, job = ? WHERE id = ?", (next_run_time, data, job_id)
+            )
+        if cursor.rowcount == 0:
+            raise JobLookupError(job.id)
+
+    def remove_job(self, job_id):
+        with self._lock:
+            cursor = self._connection.execute(f"DELETE FROM {self.tablename} WHERE id = ?", (job_id,))
+        if cursor.rowcount == 0:
+            raise JobLookupError(job_id)
+
+    def remove_all_jobs(self):
+        with self._lock:
+            self._connection.execute(f"DELETE FROM {self.tablename}")
+
+    def upsert_jobs(self, jobs):
+        """
+        Add or replace `jobs` atomically, skipping ones that are already stored as-is.
+
+        The whole batch is one transaction, so either all of it lands or none
+        of it. Returns the ids written.
+        """
+        rows = {row[0]: row for row in map(self._row, jobs)}
+        if not rows:
+            return []
+        # The scheduler's lock keeps the batch from landing between its
+        # get_due_jobs and the removal of the jobs it just fired
+        with self._scheduler._jobstores_lock, self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            ids = list(rows)
+            for start in range(0, len(ids), BATCH_SIZE):
+                batch = ids[start:start + BATCH_SIZE]
+                stored = self._connection.execute(
+                    f"SELECT id, next_run_time, job FROM {self.tablename} WHERE id IN ({','.join('?' * len(batch))})", batch
+                )
+                for row in stored:
+                    if rows[row[0]] == row:
+                        del rows[row[0]]
+            self._connection.executemany(
+                f"INSERT INTO {self.tablename} (id, next_run_time, job) VALUES (?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET next_run_time = excluded.next_run_time, job = excluded.job",
+                rows.values()
+            )
+        return list(rows)
+
+    def remove_jobs(self, job_ids):
+        """Remove `job_ids` in one transaction; returns the ids that existed."""
+        removed = []
+        with self._scheduler._jobstores_lock, self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            for start in range(0, len(job_ids), BATCH_SIZE):
+                batch = list(job_ids[start:start + BATCH_SIZE])
+                removed.extend(row[0] for row in self._connection.execute(
+                    f"DELETE FROM {self.tablename} WHERE id IN ({','.join('?' * len(batch))}) RETURNING id", batch
+                ))
+        return removed
+
+    def _get_jobs(self, where="", params=()):
+        rows = self._query(f"SELECT id, next_run_time, job FROM {self.tablename} {where} ORDER BY next_run_time", params)
+        jobs = []
+        for job_id, next_run_time, data in rows:
+            try:
+                jobs.append(self._reconstitute_job(job_id, next_run_time, data))
+            except Exception:
+                self._logger.exception('Unable to restore job "%s" -- removing it', job_id)
+                self.remove_job(job_id)
+        return jobs
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def _row(self, job):
+        return self._state_row(job.__getstate__())
+
+    @staticmethod
+    def _state_row(state):
+        # Keys are short and defaults are left out; most of a row is the request body
+        data = {"f": state["func"], "a": list(state["args"])}
+        trigger = state["trigger"]
+        if isinstance(trigger, DateTrigger):
+            data["d"] = datetime_to_utc_timestamp(trigger.run_date)
+        else:
+            data["p"] = base64.b64encode(pickle.dumps(trigger, pickle.HIGHEST_PROTOCOL)).decode()
+        if state["kwargs"]:
+            data["k"] = state["kwargs"]
+        if state["name"] != state["func"].rpartition(":")[2]:
+            data["n"] = state["name"]
+        if state["executor"] != "default":
+            data["e"] = state["executor"]
+        if state["misfire_grace_time"] is not None:
+            data["m"] = state["misfire_grace_time"]
+        if not state["coalesce"]:
+            data["c"] = False
+        if state["max_instances"] != 1:
+            data["i"] = state["max_instances"]
+        return state["id"], datetime_to_utc_timestamp(state["next_run_time"]), json.dumps(data, separators=(",", ":"))
+
+    def _reconstitute_job(self, job_id, next_run_time, data):
+        # Sets what Job.__setstate__ would, without re-resolving the function
+        # or re-validating the run date for every row
+        data = json.loads(data)
+        if "d" in data:
+            trigger = DateTrigger.__new__(DateTrigger)
+            trigger.run_date = utc_timestamp_to_datetime(data["d"])
+        else:
+            trigger = pickle.loads(base64.b64decode(data["p"]))
+        func_ref = data["f"]
+        if func_ref not in self._funcs:
+            self._funcs[func_ref] = ref_to_obj(func_ref)
+        job = Job.__new__(Job)
+        job.id = job_id
+        job.func_ref = func_ref
+        job.func = self._funcs[func_ref]
+        job.trigger = trigger
+        job.executor = data.get("e", "default")
+        job.args = tuple(data["a"])
+        job.kwargs = data.get("k", {})
+        job.name = data.get("n", func_ref.rpartition(":")[2])
+        job.misfire_grace_time = data.get("m")
+        job.coalesce = data.get("c", True)
+        job.max_instances = data.get("i", 1)
+        job.next_run_time = utc_timestamp_to_datetime(next_run_time)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _import_sqlalchemy_jobs(self):
+        with self._lock:
+            exists = self._connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'apscheduler_jobs'"
+            ).fetchone()
+            if not exists:
+                return
+            rows = self._connection.execute("SELECT id, job_state FROM apscheduler_jobs").fetchall()
+        # Converted from the pickled state, without importing the job functions
+        imported = []
+        for job_id, job_state in rows:
+            try:
+                imported.append(self._state_row(pickle.loads(job_state)))
+            except Exception as e:
+                print(f"Skipping job {job_id} from apscheduler_jobs: {e}")
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO {self.tablename} (id, next_run_time, job) VALUES (?, ?, ?)", imported
+            )
+            self._connection.execute("DROP TABLE apscheduler_jobs")
+        print(f"Imported {len(imported)} jobs from apscheduler_jobs")
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} (path={self.path})>"
+
+
+def _benchmark_task(task_id, link, headers, body):
+    pass
+
+
+def _benchmark_job(scheduler, index, run_time):
+    # Shaped like a calendar join: the cron server's defaults and a full event body
+    return Job(
+        scheduler,
+        id=f"event{index:07d}",
+        name=_benchmark_task.__name__,
+        func=_benchmark_task,
+        args=[f"event{index:07d}", "https://notetakers.example.com/join-meet", {"Content-Type": "application/json"}, {
+            "meet_link": f"https://meet.google.com/abc-defg-{index % 1000:03d}",
+            "end_time": 30,
+            "user_id": "5f0c6f3e-8f5a-4b43-9f6d-2b1d3c4e5f60",
+            "event_data": {"summary": f"Weekly sync {index}", "description": "Agenda: roadmap review",
+                           "start_time": run_time.isoformat(), "attendees": '["a@example.com", "b@example.com"]'}
+        }],
+        kwargs={},
+        trigger=DateTrigger(run_date=run_time),
+        executor="default",
+        misfire_grace_time=60,
+        coalesce=True,
+        max_instances=1,
+        next_run_time=run_time
+    )
+
+
+def benchmark(pending=100_000, sample=2_000, batch=1_000):
+    """Compare SQLAlchemyJobStore and SQLiteJobStore with `pending` jobs stored."""
+    from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    scheduler = BackgroundScheduler(timezone=pytz.utc)
+    base = datetime.now(pytz.utc).replace(microsecond=0) + timedelta(days=1)
+    jobs = [_benchmark_job(scheduler, index, base + timedelta(minutes=index % 10_000)) for index in range(pending)]
+    moved = [_benchmark_job(scheduler, index, base + timedelta(minutes=index % 10_000, seconds=30))
+             for index in range(sample)]
+    print(f"{pending} pending jobs; per-request operations timed over {sample} jobs")
+
+    def rate(elapsed, count):
+        return f"{count / elapsed:>9.0f}/s"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, make_store in (
+            ("SQLAlchemyJobStore", lambda: SQLAlchemyJobStore(url=f"sqlite:///{tmp}/legacy.sqlite")),
+            ("SQLiteJobStore", lambda: SQLiteJobStore(os.path.join(tmp, "jobs.sqlite"))),
+        ):
+            store = make_store()
+            store.start(scheduler, "default")
+            results = {}
+
+            start = time.perf_counter()
+            if isinstance(store, SQLiteJobStore):
+                for offset in range(0, pending, batch):
+                    store.upsert_jobs(jobs[offset:offset + batch])
+            else:
+                for job in jobs:
+                    store.add_job(job)
+            results["load"] = rate(time.perf_counter() - start, pending)
+
+            # What /schedule-task does for one job: look it up, then replace it
+            start = time.perf_counter()
+            for job in moved:
+                if isinstance(store, SQLiteJobStore):
+                    store.upsert_jobs([job])
+                else:
+                    store.lookup_job(job.id)
+                    store.remove_job(job.id)
+                    store.add_job(job)
+            results["reschedule"] = rate(time.perf_counter() - start, sample)
+
+            start = time.perf_counter()
+            for job in moved:
+                store.remove_job(job.id)
+            results["delete"] = rate(time.perf_counter() - start, sample)
+
+            start = time.perf_counter()
+            store.get_next_run_time()
+            results["next_run"] = f"{(time.perf_counter() - start) * 1000:>7.2f}ms"
+            store.shutdown()
+
+            # Scheduler startup only needs the due jobs and the next wakeup
+            start = time.perf_counter()
+            store = make_store()
+            store.start(scheduler, "default")
+            store.get_due_jobs(datetime.now(pytz.utc))
+            store.get_next_run_time()
+            results["startup"] = f"{(time.perf_counter() - start) * 1000:>6.1f}ms"
+            # Listing every pending job, as scheduler.get_jobs() does
+            start = time.perf_counter()
+            count = len(store.get_all_jobs())
+            results["reload"] = f"{time.perf_counter() - start:>5.2f}s"
+            store.shutdown()
+
+            size = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp)
+                       if name.startswith("legacy" if "SQLAlchemy" in label else "jobs"))
+            print(f"{label:>18}: load {results['load']}  reschedule {results['reschedule']}  "
+                  f"delete {results['delete']}  next run {results['next_run']}  "
+                  f"startup {results['startup']}  reload {results['reload']} ({count} jobs)  {size / pending:.0f} B/job")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the cron server job store")
+    arg_parser.add_argument("--jobs", type=int, default=100_000, help="pending jobs")
+    arg_parser.add_argument("--sample", type=int, default=2_000, help="jobs rescheduled and deleted one by one")
+    args = arg_parser.parse_args()
+    benchmark(args.jobs, args.sample)
@@ -0,0 +1,115 @@
+import argparse
+import hashlib
+import heapq
+import os
+import random
+from datetime import timedelta
+
+# Jobs fire this long before their requested run time, so a bot can launch its
+# browser and join before the meeting starts
+CRON_LEAD_SECONDS = int(os.getenv("CRON_LEAD_SECONDS", "120"))
+# ...plus up to this much more, spread per task, so meetings starting at the
+# same minute don't all hit the bot hosts in the same second
+CRON_SPREAD_SECONDS = int(os.getenv("CRON_SPREAD_SECONDS", "90"))
+
+
+def task_offset(task_id, lead_seconds=CRON_LEAD_SECONDS, spread_seconds=CRON_SPREAD_SECONDS):
+    """
+    Seconds before its run time that a task is dispatched.
+
+    The spread is derived from a hash of the task_id rather than drawn at
+    random, so re-scheduling an unchanged task yields the same dispatch time
+    and is recognized as unchanged.
+
+    Args:
+        task_id (str): Unique identifier for the task.
+        lead_seconds (int): Fixed lead time.
+        spread_seconds (int): Width of the window the lead is spread over.
+
+    Returns:
+        float: lead_seconds plus a per-task share of spread_seconds.
+    """
+    if spread_seconds <= 0:
+        return lead_seconds
+    digest = hashlib.sha1(task_id.encode()).digest()
+    return lead_seconds + int.from_bytes(digest[:8], "big") / 2 ** 64 * spread_seconds
+
+
+def dispatch_time(task_id, run_time, lead_seconds=CRON_LEAD_SECONDS, spread_seconds=CRON_SPREAD_SECONDS):
+    """The datetime at which a task requested for `run_time` is fired."""
+    return run_time - timedelta(seconds=task_offset(task_id, lead_seconds, spread_seconds))
+
+
+def _meeting_starts(meetings, seed=0):
+    # Seconds from the start of the hour; most meetings start on :00 or :30
+    rng = random.Random(seed)
+    starts = []
+    for _ in range(meetings):
+        kind = rng.random()
+        if kind < 0.6:
+            starts.append(0)
+        elif kind < 0.9:
+            starts.append(1800)
+        else:
+            starts.append(rng.randrange(0, 3600, 300))
+    return starts
+
+
+def simulate(meetings=2000, lead_seconds=CRON_LEAD_SECONDS, spread_seconds=CRON_SPREAD_SECONDS,
+             join_seconds=25.0, seed=0):
+    """
+    Replay one hour of meeting starts and measure the load of bots joining.
+
+    Each bot spends a lognormal `join_seconds` on average between dispatch
+    and being in the room (browser launch, page load, join click). Returns
+    the peak number of bots joining at once, the peak dispatches in one
+    second, and how many bots reach their meeting after it started.
+    """
+    rng = random.Random(seed + 1)
+    dispatches = []
+    late = 0
+    worst_late = 0.0
+    for index, start in enumerate(_meeting_starts(meetings, seed)):
+        dispatched = start - task_offset(f"event{index}", lead_seconds, spread_seconds)
+        joined = dispatched + rng.lognormvariate(0, 0.5) * join_seconds
+        dispatches.append((dispatched, joined))
+        if joined > start:
+            late += 1
+            worst_late = max(worst_late, joined - start)
+
+    per_second = {}
+    for dispatched, _ in dispatches:
+        per_second[int(dispatched // 1)] = per_second.get(int(dispatched // 1), 0) + 1
+
+    # Sweep dispatches in order, dropping bots that have finished joining
+    joining = []
+    peak_joining = 0
+    for dispatched, joined in sorted(dispatches):
+        while joining and joining[0] <= dispatched:
+            heapq.heappop(joining)
+        heapq.heappush(joining, joined)
+        peak_joining = max(peak_joining, len(joining))
+
+    return {
+        "peak_joining": peak_joining,
+        "peak_dispatches_per_second": max(per_second.values()),
+        "late": late,
+        "worst_late_seconds": round(worst_late, 1)
+    }
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Simulate bot join load for an hour of meetings")
+    arg_parser.add_argument("--meetings", type=int, default=2000, help="meetings in the hour")
+    arg_parser.add_argument("--lead", type=int, default=CRON_LEAD_SECONDS, help="lead time in seconds")
+    arg_parser.add_argument("--spread", type=int, default=CRON_SPREAD_SECONDS, help="spread window in seconds")
+    arg_parser.add_argument("--join-seconds", type=float, default=25.0, help="average dispatch-to-joined time")
+    args = arg_parser.parse_args()
+
+    print(f"{args.meetings} meetings, ~{args.join_seconds:.0f}s from dispatch to joined")
+    for label, lead, spread in (("at start time", 0, 0), (f"lead {args.lead}s", args.lead, 0),
+                                (f"lead {args.lead}s + spread {args.spread}s", args.lead, args.spread)):
+        result = simulate(args.meetings, lead, spread, args.join_seconds)
+        print(f"{label:>28}: peak {result['peak_joining']} bots joining at once, "
+              f"{result['peak_dispatches_per_second']} dispatches in one second, "
+              f"{result['late']} late (worst {result['worst_late_seconds']}s)")
@@ -1,76 +1,91 @@
 from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
+from typing import Optional
 import uvicorn
-from datetime import datetime, timedelta
 
-from .google_meet.gmeet import join_meet
-from .zoom.zoom import join_zoom_meeting
-from .agent.cleanup import clean_google_meet_transcript
-from .agent.summarizer import summarize_transcript
-from supabase import create_client, Client
+from .google_meet.resources import host_resources
+from .jobs import job_manager
+from .http_client import http_client
+from . import db
 
-import os
-import json
+import asyncio
 from dotenv import load_dotenv
 from fastapi.responses import JSONResponse
-from .calendars.google import get_access_token_from_refresh_token, sync_google_calendar_events, sync_google_calendar
-from .calendars.utils import filter_meeting_events, get_meeting_link
-from .calendars.cron import upsert_cron_job
-from dateutil import parser
+from .calendars.google import sync_google_calendar, token_cache, write_stats, channel_registry
+from .calendars.coalescer import sync_coalescer
+from .calendars.resync import FleetResync
 
 load_dotenv()
 
 app = FastAPI()
 
-# Initialize Supabase client
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+@app.on_event("startup")
+async def startup():
+    # Meeting worker processes pre-launch a browser as soon as they spawn
+    job_manager.start()
+    await http_client.start()
+    sync_coalescer.start()
+    await channel_registry.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await job_manager.shutdown()
+    await channel_registry.close()
+    await sync_coalescer.close()
+    await http_client.close()
+    db.database.close()
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "host": host_resources.capacity(active=job_manager.active()),
+        "jobs": job_manager.stats(),
+        "google_tokens": token_cache.stats(),
+        "calendar_sync": {**sync_coalescer.stats(), **write_stats},
+        "calendar_channels": channel_registry.stats(),
+        "db": db.database.stats()
+    }
 
 class MeetRequest(BaseModel):
     meet_link: str
     end_time: int
     user_id: str
+    # The calendar event, when scheduled from one; its end_time bounds the stay
+    event_data: Optional[dict] = None
 
-@app.post("/join-meet")
+@app.post("/join-meet", status_code=202)
 async def join_meet_endpoint(request: MeetRequest):
     if not request.meet_link:
         raise HTTPException(status_code=400, detail="Meet link is required")
     if request.end_time <= 0:
         raise HTTPException(status_code=400, detail="End time must be greater than 0")
-    
-    start_time = datetime.now()
-    transcript = await join_meet(request.meet_link, request.end_time)
-
-    # Calculate duration
-    end_time = datetime.now()
-    
-    if not transcript:
-        return {"summary": "Agent was never accepted into the call", "cleaned_transcript": []}
-    
-    cleaned_transcript = clean_google_meet_transcript(transcript)
-    
-    cleaned_transcript_text = '\n'.join([f"{entry['user']} at {entry['time']}: {entry['content']}" for entry in cleaned_transcript])
-    
-    summary = summarize_transcript(cleaned_transcript_text)
-    
-
-    # Add to Supabase
-    data = {
-        "user_id": request.user_id,
-        "meeting_link": request.meet_link,
-        "summary": json.dumps(summary),
-        "transcript": json.dumps(cleaned_transcript),
-        "start_time": start_time.isoformat(),
-        "end_time": end_time.isoformat(),
-        "attendees": json.dumps(list(set([entry['user'] for entry in cleaned_transcript]))),
-        "type":"gmeet"
-    }
-    response = supabase.table("meetings").insert(data).execute()
-    print(response)
-    
-    return {"summary": summary, "cleaned_transcript": cleaned_transcript}
+
+    # The meeting runs in a worker process; poll /jobs/{job_id} for the outcome
+    job_id = job_manager.submit("meet", request.model_dump())
+    return {"status": "queued", "job_id": job_id}
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {key: value for key, value in job.items() if key != "result"}
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] in ("queued", "running"):
+        return JSONResponse({"status": job["status"], "job_id": job_id}, status_code=202)
+    if job["status"] == "failed":
+        return JSONResponse({"status": "failed", "job_id": job_id, "detail": job["error"]}, status_code=500)
+    return {"status": "succeeded", "job_id": job_id, "result": job["result"]}
+
+@app.get("/capacity")
+async def capacity():
+    # How many more bots this host can take, for schedulers spreading meetings across hosts
+    return host_resources.capacity(active=job_manager.active())
 
 @app.post('/gcal-notifications')
 async def handle_notification(request: Request):
@@ -98,80 +113,17 @@ async def handle_notification(request: Request):
             print("User ID is missing in token.")
             raise HTTPException(status_code=400, detail="User ID is required in token")
 
-        # Fetch the Google refresh token and sync token from the 'integrations' table using the user_id
-        print(f"Fetching Google tokens for user_id: {user_id}")
-        response = supabase.table("integrations").select("google_token", "google_sync_token").eq("user_id", user_id).execute()
-        if not response.data:
-            print("Google tokens not found for the given user_id.")
-            raise HTTPException(status_code=404, detail="Google tokens not found for the given user_id")
-
-        google_refresh_token = response.data[0]['google_token']['refresh_token']
-        sync_token = response.data[0].get('google_sync_token')
-        print("Google tokens retrieved successfully.")
-
-        # Use the refresh token to get a new access token
-        print("Obtaining new access token using the refresh token.")
-        access_token = await get_access_token_from_refresh_token(google_refresh_token)
-        if not access_token:
-            print("Failed to obtain access token.")
-            raise HTTPException(status_code=500, detail="Failed to obtain access token")
-        print("Access token obtained successfully.")
-
-        # Perform a sync using the sync token
-        print("Performing sync using the sync token.")
-        events, new_sync_token = await sync_google_calendar_events(access_token, sync_token)
-        if new_sync_token:
-            supabase.table("integrations").update({"google_sync_token": new_sync_token}).eq("user_id", user_id).execute()
-        print("Sync completed successfully.")
-        # Filter events with valid meeting links
-        meet_events = filter_meeting_events(events)
-        
-        # Insert or update meet events in the Supabase database
-        for event in meet_events:
-            event_data = {
-                "user_id": user_id,
-                "event_id": event['id'],
-                "summary": event.get('summary', ''),
-                "description": event.get('description', ''),
-                "start_time": event['start']['dateTime'],
-                "end_time": event['end']['dateTime'],
-                "link": event.get('hangoutLink', event.get('location', '')),
-                "attendees": json.dumps([attendee['email'] for attendee in event.get('attendees', [])]),
-            }
-            res,error = supabase.table("calevents").upsert(event_data, on_conflict=["event_id"]).execute()
-            print(res, error)
-            print('upserting cron')
-            meeting_link = get_meeting_link(event)
-            base_url = os.getenv("SERVER_ENDPOINT")
-
-            if "zoom.us" in meeting_link:
-                link = base_url + "/join-zoom"
-            elif "meet.google.com" in meeting_link or "teams.microsoft" not in meeting_link:
-                link = base_url + "/join-meet"
-            else:
-                link = base_url + "/join-teams"
-
-            print(link)
-            print(meeting_link)
-
-            await upsert_cron_job(
-                task_id=event['id'],
-                run_time=event['start']['dateTime'],
-                link=link,
-                headers={"Content-Type": "application/json"},
-                body={
-                    "meet_link": meeting_link,
-                    "end_time": int((parser.isoparse(event['end']['dateTime']) - parser.isoparse(event['start']['dateTime'])).total_seconds() / 60),
-                    "user_id": user_id,
-                    "event_data": event_data
-                }
-            )
-        # Delete any non-meet or canceled events from the Supabase database
-        non_meet_event_ids = [event['id'] for event in events if event not in meet_events or event.get('status') == 'cancelled']
-        if non_meet_event_ids:
-            supabase.table("calevents").delete().in_("event_id", non_meet_event_ids).execute()
-        
-        print('Events with valid meeting links upserted/updated in Supabase successfully.')
+        # Superseded or foreign channels: acknowledge so Google stops retrying, but don't sync
+        known = await channel_registry.is_known(
+            channel_id, user_id, headers.get('X-Goog-Resource-ID'), headers.get('X-Goog-Channel-Expiration')
+        )
+        if not known:
+            print(f"Ignoring notification from unknown channel {channel_id}")
+            return JSONResponse({"status": "ignored"}, status_code=200)
+
+        # Acknowledge right away so Google doesn't retry; bursts for the same
+        # user collapse into one sync that a background worker runs
+        sync_coalescer.request(user_id)
 
         return JSONResponse({"status": "success"}, status_code=200)
     except Exception as e:
@@ -197,11 +149,11 @@ async def sync_calendar(request: Request):
             raise HTTPException(status_code=400, detail="Missing user_id")
 
         # Fetch the Google refresh token from the 'integrations' table using the user_id
-        response = supabase.table("integrations").select("google_token").eq("user_id", user_id).execute()
-        if not response.data:
+        integration = await db.get_integration(user_id, "google_token")
+        if not integration:
             raise HTTPException(status_code=404, detail="Google token not found for the given user_id")
 
-        google_refresh_token = response.data[0]['google_token']['refresh_token']
+        google_refresh_token = integration['google_token']['refresh_token']
 
         # Call the sync_google_calendar function
         await sync_google_calendar(google_refresh_token, user_id)
@@ -212,6 +164,30 @@ async def sync_calendar(request: Request):
         print(f"An error occurred: {e}")
         return JSONResponse({"status": "error", "detail": str(e)}, status_code=400)
 
+class ResyncRequest(BaseModel):
+    concurrency: Optional[int] = None
+    full: bool = False
+
+# The fleet-wide resync currently or last running in this process
+fleet_resync = {"resync": None, "task": None}
+
+@app.post("/resync-calendars", status_code=202)
+async def resync_calendars(request: ResyncRequest):
+    if fleet_resync["task"] is not None and not fleet_resync["task"].done():
+        raise HTTPException(status_code=409, detail="A resync is already running")
+
+    # Resumes from the checkpoint of an interrupted run; poll GET /resync-calendars for progress
+    resync = FleetResync(full=request.full) if request.concurrency is None else FleetResync(request.concurrency, full=request.full)
+    fleet_resync["resync"] = resync
+    fleet_resync["task"] = asyncio.create_task(resync.run())
+    return {"status": "started"}
+
+@app.get("/resync-calendars")
+async def resync_progress():
+    if fleet_resync["resync"] is None:
+        raise HTTPException(status_code=404, detail="No resync has been started")
+    return fleet_resync["resync"].progress()
+
 @app.post("/join-zoom")
 async def join_zoom(request: Request):
     try:
@@ -227,26 +203,15 @@ async def join_zoom(request: Request):
         if end_time is None:
             raise HTTPException(status_code=400, detail="Missing end_time")
 
-        # Call the join_zoom_meeting function from zoom.py
-        transcript = join_zoom_meeting(meeting_link, end_time)
-
-        summary = summarize_transcript(transcript)
-
-        data = {
+        # The meeting runs as a task on this process's event loop; poll /jobs/{job_id} for the outcome
+        job_id = job_manager.submit("zoom", {
             "user_id": user_id,
-            "meeting_link": meeting_link,
-            "summary": json.dumps(summary),
-            "transcript": json.dumps(transcript),
-            "start_time": parser.isoparse(event_data.get('start_time')).isoformat(),
-            "end_time": (parser.isoparse(event_data.get('start_time')) + timedelta(minutes=int(end_time))).isoformat(),
-            "attendees": event_data.get('attendees'),
-            "type":"zoom"
-        }
-
-        response = supabase.table("meetings").insert(data).execute()
-        print(response)
-    
-        return JSONResponse({"status": "success", "transcript": transcript}, status_code=200)
+            "meet_link": meeting_link,
+            "end_time": end_time,
+            "event_data": event_data
+        })
+
+        return JSONResponse({"status": "queued", "job_id": job_id}, status_code=202)
 
     except Exception as e:
         print(f"An error occurred: {e}")
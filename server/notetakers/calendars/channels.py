@@ -0,0 +1,200 @@
+import asyncio
+import os
+import time
+import uuid
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote
+from dotenv import load_dotenv
+from .. import db
+from ..http_client import get_session
+
+load_dotenv(dotenv_path='@.env')
+
+# Lifetime requested for new watch channels; Google may grant less
+CHANNEL_TTL_SECONDS = int(os.getenv("CHANNEL_TTL_SECONDS", str(7 * 24 * 3600)))
+# Channels closer than this to expiring are replaced
+CHANNEL_RENEW_BEFORE_SECONDS = int(os.getenv("CHANNEL_RENEW_BEFORE_SECONDS", str(24 * 3600)))
+# How often the renewal loop looks for expiring channels
+CHANNEL_RENEW_INTERVAL_SECONDS = int(os.getenv("CHANNEL_RENEW_INTERVAL_SECONDS", "3600"))
+
+# Overridable so syncs can run against local fake Google servers
+GOOGLE_CALENDAR_API = os.getenv("GOOGLE_CALENDAR_API", "https://www.googleapis.com/calendar/v3")
+
+
+class ChannelRegistry:
+    """
+    Tracks the Google Calendar watch channel of each user's calendar.
+
+    Channels are stored in the `calendar_channels` table (channel_id,
+    user_id, calendar_id, resource_id, expiration in epoch milliseconds) and
+    mirrored in memory, so notifications from live channels are checked
+    without touching the database. A user has one live channel per
+    calendar: creating a new one stops the ones it supersedes, and a
+    background loop replaces channels before they expire.
+
+    `access_token_for_user(user_id, rejected=None)` is an async function
+    returning a fresh access token for a user_id, other than `rejected` when
+    given; it is used for renewals and to retry a watch Google answered with
+    a 401.
+    """
+
+    def __init__(self, access_token_for_user):
+        self._access_token_for_user = access_token_for_user
+        # channel_id -> calendar_channels row
+        self._channels = {}
+        self._task = None
+        self._counters = {"created": 0, "reused": 0, "stopped": 0, "renewed": 0, "renew_failures": 0, "dropped": 0,
+                          "adopted": 0}
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._channels = {row["channel_id"]: row for row in await db.list_channels()}
+        self._task = asyncio.create_task(self._renew_loop())
+        print(f"Loaded {len(self._channels)} calendar watch channels")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def is_known(self, channel_id, user_id, resource_id=None, expiration=None):
+        """
+        Whether a notification comes from a live channel of this user.
+
+        Channels missing from memory are looked up in the database, since
+        another worker or replica may have created them. A channel of a user
+        with no registered channel at all predates the registry; it is
+        adopted as the user's primary calendar channel, using the resource
+        id and expiration headers of the notification, so it gets renewed.
+        """
+        row = self._channels.get(channel_id)
+        if row is None:
+            row = await db.get_channel(channel_id)
+            if row is not None:
+                self._channels[channel_id] = row
+        if row is None and resource_id and not await db.list_user_channels(user_id):
+            row = await self._adopt(channel_id, user_id, resource_id, expiration)
+        if row is None or row["user_id"] != user_id:
+            self._counters["dropped"] += 1
+            return False
+        return True
+
+    def channels_for(self, user_id, calendar_id="primary"):
+        """The user's channels on a calendar, newest expiration first."""
+        rows = [row for row in self._channels.values() if row["user_id"] == user_id and row["calendar_id"] == calendar_id]
+        return sorted(rows, key=lambda row: row["expiration"], reverse=True)
+
+    async def ensure(self, access_token, user_id, calendar_id="primary"):
+        """Keep the user's current channel if it has time left, otherwise watch again."""
+        channels = self.channels_for(user_id, calendar_id)
+        if channels and channels[0]["expiration"] / 1000 - time.time() > CHANNEL_RENEW_BEFORE_SECONDS:
+            self._counters["reused"] += 1
+            for row in channels[1:]:
+                await self._stop(access_token, row)
+            return channels[0]
+        return await self.watch(access_token, user_id, calendar_id)
+
+    async def watch(self, access_token, user_id, calendar_id="primary"):
+        """Open a new channel for the calendar and stop the ones it replaces."""
+        superseded = self.channels_for(user_id, calendar_id)
+        data = {
+            "id": str(uuid.uuid4()),
+            "type": "web_hook",
+            "address": os.getenv('SERVER_ENDPOINT') + "/gcal-notifications",
+            "token": user_id,
+            "params": {"ttl": str(CHANNEL_TTL_SECONDS)}
+        }
+        url = f"{GOOGLE_CALENDAR_API}/calendars/{quote(calendar_id)}/events/watch"
+        for attempt in range(2):
+            headers = {"Authorization": f"Bearer {access_token}"}
+            async with get_session().post(url, headers=headers, json=data) as response:
+                response_data = await response.json()
+                status = response.status
+            if status == 401 and not attempt:
+                # Revoked or rotated since it was cached
+                access_token = await self._access_token_for_user(user_id, rejected=access_token)
+                continue
+            break
+        if status != 200:
+            error_message = response_data.get("error", {}).get("message", "Unknown error")
+            print(f"Failed to create event subscription, response status: {status}, error: {error_message}")
+            raise Exception(f"Failed to create event subscription: {error_message}")
+
+        row = {
+            "channel_id": response_data["id"],
+            "user_id": user_id,
+            "calendar_id": calendar_id,
+            "resource_id": response_data["resourceId"],
+            "expiration": int(response_data.get("expiration") or (time.time() + CHANNEL_TTL_SECONDS) * 1000)
+        }
+        await db.upsert_channel(row)
+        self._channels[row["channel_id"]] = row
+        self._counters["created"] += 1
+        print(f"New subscription set for channel ID: {row['channel_id']}")
+
+        for old in superseded:
+            await self._stop(access_token, old)
+        return row
+
+    async def renew_expiring(self):
+        """Replace every channel that expires within CHANNEL_RENEW_BEFORE_SECONDS."""
+        deadline = (time.time() + CHANNEL_RENEW_BEFORE_SECONDS) * 1000
+        due = {(row["user_id"], row["calendar_id"]) for row in self._channels.values()}
+        due = [key for key in due if self.channels_for(*key)[0]["expiration"] < deadline]
+        for user_id, calendar_id in due:
+            try:
+                access_token = await self._access_token_for_user(user_id)
+                await self.watch(access_token, user_id, calendar_id)
+                self._counters["renewed"] += 1
+            except Exception as e:
+                self._counters["renew_failures"] += 1
+                print(f"Failed to renew watch channel for user {user_id}: {e}")
+
+    def stats(self):
+        return {"channels": len(self._channels), **self._counters}
+
+    async def _adopt(self, channel_id, user_id, resource_id, expiration):
+        try:
+            # e.g. "Tue, 19 Nov 2013 01:13:52 GMT"
+            expires_at = parsedate_to_datetime(expiration).timestamp()
+        except (TypeError, ValueError):
+            # Unknown: renew on the next pass
+            expires_at = time.time()
+        row = {
+            "channel_id": channel_id,
+            "user_id": user_id,
+            "calendar_id": "primary",
+            "resource_id": resource_id,
+            "expiration": int(expires_at * 1000)
+        }
+        await db.upsert_channel(row)
+        self._channels[channel_id] = row
+        self._counters["adopted"] += 1
+        print(f"Adopted unregistered watch channel {channel_id} for user {user_id}")
+        return row
+
+    async def _stop(self, access_token, row):
+        url = f"{GOOGLE_CALENDAR_API}/channels/stop"
+        headers = {"Authorization": f"Bearer {access_token}"}
+        data = {"id": row["channel_id"], "resourceId": row["resource_id"]}
+        try:
+            async with get_session().post(url, headers=headers, json=data) as response:
+                # 404: already expired or stopped on Google's side
+                if response.status not in (200, 204, 404):
+                    print(f"Failed to stop channel {row['channel_id']}: {response.status} {await response.text()}")
+        except Exception as e:
+            print(f"Failed to stop channel {row['channel_id']}: {e}")
+        # Forget it either way; its notifications are dropped from now on
+        await db.delete_channel(row["channel_id"])
+        self._channels.pop(row["channel_id"], None)
+        self._counters["stopped"] += 1
+
+    async def _renew_loop(self):
+        while True:
+            try:
+                await self.renew_expiring()
+            except Exception as e:
+                print(f"Channel renewal pass failed: {e}")
+            await asyncio.sleep(CHANNEL_RENEW_INTERVAL_SECONDS)
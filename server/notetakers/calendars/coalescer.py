@@ -0,0 +1,159 @@
+import asyncio
+import os
+import time
+from collections import deque
+from dotenv import load_dotenv
+from .google import sync_user_calendar
+
+load_dotenv(dotenv_path='@.env')
+
+# Notifications for one user arriving within this window share a single sync
+SYNC_DEBOUNCE_SECONDS = float(os.getenv("SYNC_DEBOUNCE_SECONDS", "2"))
+# Calendar syncs running at the same time across all users
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "8"))
+# Recent syncs kept for the latency figures in stats()
+SYNC_LATENCY_SAMPLES = 200
+
+
+class SyncCoalescer:
+    """
+    Per-user debouncing of calendar syncs, drained by a bounded worker pool.
+
+    A request waits `window` seconds so the rest of a notification burst can
+    join it, then the user is queued once and one of `workers` syncs them for
+    everyone who asked.
+
+    Ordering per user:
+      - A user is in the queue at most once, and at most one sync runs per
+        user at a time, so syncs never race on the stored sync token.
+      - Requests that arrive while a sync is running are not folded into it
+        (it may already have read past their change); they get one trailing
+        sync, queued after the running one finishes.
+      - Each request is covered by the first sync that starts after it.
+    Nothing is ordered across users. The queue holds at most one entry per
+    user, so its depth is bounded by the number of users.
+    """
+
+    def __init__(self, sync, window=SYNC_DEBOUNCE_SECONDS, workers=SYNC_WORKERS):
+        self._sync = sync
+        self.window = window
+        self.workers = workers
+        # user_id -> {"pending": future for the next sync, "requested_at", "running": bool}
+        self._users = {}
+        self._queue = None
+        self._tasks = []
+        self._latencies = deque(maxlen=SYNC_LATENCY_SAMPLES)
+        self._durations = deque(maxlen=SYNC_LATENCY_SAMPLES)
+        self._counters = {"requests": 0, "coalesced": 0, "syncs": 0, "trailing": 0, "failures": 0}
+
+    def start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        print(f"Calendar sync queue started with {self.workers} workers")
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for state in self._users.values():
+            if state["pending"] is not None:
+                state["pending"].cancel()
+        self._users.clear()
+        self._tasks = []
+        self._queue = None
+
+    def request(self, user_id):
+        """
+        Ask for a sync of `user_id` without waiting for it.
+
+        Returns an awaitable that resolves with the result of the first sync
+        that starts after this call.
+        """
+        self.start()
+        self._counters["requests"] += 1
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = {"pending": None, "requested_at": None, "running": False}
+
+        if state["pending"] is not None:
+            self._counters["coalesced"] += 1
+            return _shielded(state["pending"])
+
+        state["pending"] = asyncio.get_running_loop().create_future()
+        # Nobody may await it; don't warn about an unretrieved exception
+        state["pending"].add_done_callback(_retrieve)
+        state["requested_at"] = time.monotonic()
+        if state["running"]:
+            # Queued by the worker once the running sync finishes
+            self._counters["trailing"] += 1
+        else:
+            self._schedule(user_id)
+        return _shielded(state["pending"])
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "waiting": sum(1 for state in self._users.values() if state["pending"] is not None and not state["running"]),
+            "running": sum(1 for state in self._users.values() if state["running"]),
+            **self._counters,
+            # From the first request of a burst until its sync finished
+            "latency_seconds": _summary(self._latencies),
+            "sync_seconds": _summary(self._durations)
+        }
+
+    def _schedule(self, user_id):
+        queue = self._queue
+        asyncio.get_running_loop().call_later(self.window, queue.put_nowait, user_id)
+
+    async def _worker(self):
+        while True:
+            user_id = await self._queue.get()
+            state = self._users[user_id]
+            future, state["pending"] = state["pending"], None
+            requested_at = state["requested_at"]
+            state["running"] = True
+            self._counters["syncs"] += 1
+            started = time.monotonic()
+            try:
+                future.set_result(await self._sync(user_id))
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                self._counters["failures"] += 1
+                print(f"Calendar sync failed for user {user_id}: {e}")
+                future.set_exception(e)
+            finally:
+                finished = time.monotonic()
+                self._durations.append(finished - started)
+                self._latencies.append(finished - requested_at)
+                state["running"] = False
+                if state["pending"] is not None:
+                    self._schedule(user_id)
+                else:
+                    del self._users[user_id]
+
+
+def _retrieve(future):
+    # Marks the exception as retrieved; the worker has already logged it
+    future.cancelled() or future.exception()
+
+
+def _shielded(future):
+    # Callers like the webhook handler drop the returned awaitable, so its
+    # exception must not be reported as never retrieved either
+    waiter = asyncio.shield(future)
+    waiter.add_done_callback(_retrieve)
+    return waiter
+
+
+def _summary(samples):
+    if not samples:
+        return {"avg": 0, "max": 0}
+    return {"avg": round(sum(samples) / len(samples), 3), "max": round(max(samples), 3)}
+
+
+sync_coalescer = SyncCoalescer(sync_user_calendar)
@@ -1,15 +1,16 @@
-import aiohttp
 from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 from dateutil import parser
 import pytz
 
+from ..http_client import get_session
+
 load_dotenv(dotenv_path='@.env')
 
-async def upsert_cron_job(task_id, run_time, link, headers, body):
+def build_cron_task(task_id, run_time, link, headers, body):
     """
-    Schedules or updates a cron job with the given task details.
+    Builds the payload the cron server expects for one task.
 
     If the run_time is not provided, the task is scheduled to run 5 minutes from the current time.
 
@@ -21,14 +22,12 @@ async def upsert_cron_job(task_id, run_time, link, headers, body):
         body (dict): JSON body to include in the POST request.
 
     Raises:
-        ValueError: If the CRON_URL environment variable is not set.
-        Exception: If the task scheduling request fails.
+        ValueError: If run_time is not in ISO 8601 format.
 
     Returns:
-        None
+        dict: The task details with run_time converted to UTC 'YYYY-MM-DD HH:MM:SS'.
     """
     # Calculate the run time 5 minutes from now if not provided
-    print(run_time)
     if not run_time:
         run_time = (datetime.utcnow() + timedelta(minutes=5)).strftime('%Y-%m-%d %H:%M:%S')
     else:
@@ -42,8 +41,7 @@ async def upsert_cron_job(task_id, run_time, link, headers, body):
         except ValueError:
             raise ValueError("Invalid run_time format. Expected ISO 8601 format.")
 
-    # Define the task details
-    task_data = {
+    return {
         "task_id": task_id,
         "run_time": run_time,
         "link": link,
@@ -51,6 +49,30 @@ async def upsert_cron_job(task_id, run_time, link, headers, body):
         "body": body
     }
 
+
+async def upsert_cron_job(task_id, run_time, link, headers, body):
+    """
+    Schedules or updates a cron job with the given task details.
+
+    If the run_time is not provided, the task is scheduled to run 5 minutes from the current time.
+
+    Args:
+        task_id (str): Unique identifier for the task.
+        run_time (str): The time at which the task should be executed, in ISO 8601 format.
+        link (str): The URL to which the task will send a POST request.
+        headers (dict): HTTP headers to include in the POST request.
+        body (dict): JSON body to include in the POST request.
+
+    Raises:
+        ValueError: If the CRON_URL environment variable is not set.
+        Exception: If the task scheduling request fails.
+
+    Returns:
+        None
+    """
+    print(run_time)
+    task_data = build_cron_task(task_id, run_time, link, headers, body)
+
     # Get the CRON_URL from environment variables
     cron_url = os.environ.get("CRON_URL")
 
@@ -58,15 +80,49 @@ async def upsert_cron_job(task_id, run_time, link, headers, body):
         raise ValueError("CRON_URL environment variable is not set")
 
     # Schedule the task
-    async with aiohttp.ClientSession() as session:
-        async with session.post(f"{cron_url}/schedule-task", json=task_data) as response:
-            # Check if the request was successful
-            if response.status != 200:
-                error_detail = await response.text()
-                raise Exception(f"Failed to schedule task: {response.status} - {error_detail}")
+    async with get_session().post(f"{cron_url}/schedule-task", json=task_data) as response:
+        # Check if the request was successful
+        if response.status != 200:
+            error_detail = await response.text()
+            raise Exception(f"Failed to schedule task: {response.status} - {error_detail}")
+
+        # Print the response
+        print(await response.json())
+
+
+async def upsert_cron_jobs(tasks):
+    """
+    Schedules or updates many cron jobs in a single request.
+
+    The cron server validates the whole batch and writes it in one
+    transaction, so either every task is scheduled or none are.
+
+    Args:
+        tasks (list): Task payloads as returned by build_cron_task.
+
+    Raises:
+        ValueError: If the CRON_URL environment variable is not set.
+        Exception: If the scheduling request fails.
+
+    Returns:
+        None
+    """
+    if not tasks:
+        return
+
+    # Get the CRON_URL from environment variables
+    cron_url = os.environ.get("CRON_URL")
+
+    if not cron_url:
+        raise ValueError("CRON_URL environment variable is not set")
+
+    async with get_session().post(f"{cron_url}/schedule-tasks", json={"tasks": tasks}) as response:
+        if response.status != 200:
+            error_detail = await response.text()
+            raise Exception(f"Failed to schedule tasks: {response.status} - {error_detail}")
 
-            # Print the response
-            print(await response.json())
+        result = await response.json()
+        print(f"Scheduled {len(result.get('task_ids', []))} cron tasks, {result.get('unchanged', 0)} already up to date")
 
 
 async def delete_cron_job(task_id):
@@ -90,12 +146,11 @@ async def delete_cron_job(task_id):
         raise ValueError("CRON_URL environment variable is not set")
 
     # Send a request to delete the task
-    async with aiohttp.ClientSession() as session:
-        async with session.delete(f"{cron_url}/delete-task", params={"task_id": task_id}) as response:
-            # Check if the request was successful
-            if response.status != 200:
-                error_detail = await response.text()
-                raise Exception(f"Failed to delete task: {response.status} - {error_detail}")
-
-            # Print the response
-            print(await response.json())
\ No newline at end of file
+    async with get_session().delete(f"{cron_url}/delete-task", params={"task_id": task_id}) as response:
+        # Check if the request was successful
+        if response.status != 200:
+            error_detail = await response.text()
+            raise Exception(f"Failed to delete task: {response.status} - {error_detail}")
+
+        # Print the response
+        print(await response.json())
\ No newline at end of file
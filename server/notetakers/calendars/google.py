@@ -1,25 +1,34 @@
-import aiohttp
+import asyncio
 import json 
-from supabase import create_client, Client
 import os
 from dotenv import load_dotenv
-import uuid
-from .utils import filter_meeting_events, get_meeting_link
-from .cron import upsert_cron_job
+from .utils import event_fingerprint
+from .links import meeting_links
+from .cron import build_cron_task, upsert_cron_jobs
+from .tokens import AccessTokenCache
+from .channels import ChannelRegistry, GOOGLE_CALENDAR_API
+from .. import db
+from ..http_client import get_session
 from dateutil import parser
 from datetime import datetime
+from urllib.parse import quote
 
 load_dotenv(dotenv_path='@.env')
 
-# Initialize Supabase client
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Events per events.list page; each page is persisted before the next is fetched
+GOOGLE_SYNC_PAGE_SIZE = int(os.getenv("GOOGLE_SYNC_PAGE_SIZE", "250"))
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Calendars of one user fetched at the same time
+GOOGLE_CALENDAR_CONCURRENCY = int(os.getenv("GOOGLE_CALENDAR_CONCURRENCY", "4"))
+
+# Calevent writes done and avoided by change detection, reported under /metrics
+write_stats = {"events_written": 0, "events_skipped": 0, "events_deleted": 0}
 
 # Load Google OAuth client credentials from environment variables
 GOOGLE_CLIENT_ID = os.getenv("NEXT_PUBLIC_GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
+# Overridable so syncs can run against local fake Google servers
+GOOGLE_OAUTH_TOKEN_URL = os.getenv("GOOGLE_OAUTH_TOKEN_URL", "https://oauth2.googleapis.com/token")
 
 async def sync_google_calendar(refresh_token: str, user_id: str):
     try:
@@ -31,74 +40,35 @@ async def sync_google_calendar(refresh_token: str, user_id: str):
             raise Exception("Failed to obtain access token")
         print(f"Access token obtained: {access_token}")
 
-        # Step 2: Fetch future calendar events
-        events, sync_token = await sync_google_calendar_events(access_token)
-        if sync_token:
-            supabase.table("integrations").update({"google_sync_token": sync_token}).eq("user_id", user_id).execute()
-        if events is None:
-            raise Exception("Failed to fetch calendar events: No response from server")
-        elif not events:
+        # Step 2: Stream future events from every calendar, pushing each page to Supabase as it arrives
+        result = await sync_calendars(access_token, user_id, {}, refresh_token=refresh_token)
+
+        # Only store sync tokens once every page of their calendar has been persisted
+        await db.update_integration(user_id, {
+            "google_sync_tokens": result["sync_tokens"],
+            "google_sync_token": result["sync_tokens"].get("primary")
+        })
+
+        if not result["events"]:
             print("No future events found")
         else:
-            print(f"Fetched {len(events)} events")
-
-            print(events)
-
-            # Step 3: Filter events with valid meeting links
-            meet_events = filter_meeting_events(events)
-            print(f"Found {len(meet_events)} events with valid meeting links")
-
-            # Step 4: Set up subscriptions for changes in events
-            # NOTE: Figure out a way to delete these calendars event handlers once they are created
-            try:
-                await setup_event_subscriptions(access_token, user_id)
-                print("Event subscriptions set up")
-            except Exception as e:
-                print(f"Failed to set up event subscription, but continuing: {e}")
-
-            # Step 5: Push events to Supabase
-            for event in meet_events:
-                event_data = {
-                    "user_id": user_id,
-                    "event_id": event['id'],
-                    "summary": event.get('summary', ''),
-                    "description": event.get('description', ''),
-                    "start_time": event['start']['dateTime'],
-                    "end_time": event['end']['dateTime'],
-                    "link": event.get('hangoutLink', event.get('location', '')),
-                    "attendees": json.dumps([attendee['email'] for attendee in event.get('attendees', [])]),
-                }
-                supabase.table("calevents").upsert(event_data, on_conflict=["event_id"]).execute()
-
-                meeting_link = get_meeting_link(event)
-                base_url = os.getenv("SERVER_ENDPOINT")
-
-                if "zoom.us" in meeting_link:
-                    link = base_url + "/join-zoom"
-                elif "meet.google.com" in meeting_link or "teams.microsoft" not in meeting_link:
-                    link = base_url + "/join-meet"
-                else:
-                    link = base_url + "/join-teams"
-
-                await upsert_cron_job(
-                    task_id=event['id'],
-                    run_time=event['start']['dateTime'],
-                    link=link,
-                    headers={"Content-Type": "application/json"},
-                    body={
-                    "meet_link": meeting_link,
-                    "end_time": int((parser.isoparse(event['end']['dateTime']) - parser.isoparse(event['start']['dateTime'])).total_seconds() / 60),
-                    "user_id": user_id,
-                    "event_data": event_data
-                    }
-                )
+            print(f"Fetched {result['events']} events from {len(result['calendars'])} calendars")
+
+            # Step 3: Watch each calendar for changes, reusing channels that are still live
+            for calendar_id in result["calendars"]:
+                try:
+                    await channel_registry.ensure(access_token, user_id, calendar_id)
+                except Exception as e:
+                    print(f"Failed to set up event subscription for {calendar_id}, but continuing: {e}")
+            print("Event subscriptions set up")
             print('pushed all to supabase')
     except Exception as e:
         print(f"An error occurred: {e}")
 
-async def get_access_token_from_refresh_token(refresh_token: str) -> str:
+async def exchange_refresh_token(refresh_token: str):
+    """Exchange a refresh token for (access_token, expires_in) at Google's token endpoint."""
     print("Getting access token from refresh token")
-    url = "https://oauth2.googleapis.com/token"
+    url = GOOGLE_OAUTH_TOKEN_URL
     headers = {
         "Content-Type": "application/x-www-form-urlencoded"
     }
@@ -108,98 +78,351 @@ async def get_access_token_from_refresh_token(refresh_token: str) -> str:
         "refresh_token": refresh_token,
         "grant_type": "refresh_token"
     }
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, data=data) as response:
-            response_data = await response.json()
-            access_token = response_data.get("access_token")
-            return access_token
+    async with get_session().post(url, headers=headers, data=data) as response:
+        response_data = await response.json()
+        return response_data.get("access_token"), response_data.get("expires_in", 0)
+
+token_cache = AccessTokenCache(exchange_refresh_token)
+
+async def get_access_token_from_refresh_token(refresh_token: str) -> str:
+    # Served from the cache until shortly before the token expires
+    return await token_cache.get(refresh_token)
 
-async def fetch_calendar_events(access_token: str) -> list:
+async def renew_access_token(refresh_token: str, rejected: str) -> str:
+    # Google answered 401 to `rejected` (revoked or rotated): drop it and refresh
+    token_cache.invalidate(refresh_token, rejected)
+    return await token_cache.get(refresh_token)
+
+async def access_token_for_user(user_id: str, rejected: str = None) -> str:
+    integration = await db.get_integration(user_id, "google_token")
+    if not integration:
+        raise Exception("Google token not found for the given user_id")
+    refresh_token = integration['google_token']['refresh_token']
+    if rejected:
+        access_token = await renew_access_token(refresh_token, rejected)
+    else:
+        access_token = await get_access_token_from_refresh_token(refresh_token)
+    if not access_token:
+        raise Exception("Failed to obtain access token")
+    return access_token
+
+channel_registry = ChannelRegistry(access_token_for_user)
+
+async def fetch_calendar_events(access_token: str, calendar_id: str = "primary") -> list:
     print("Fetching future calendar events")
     now = datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
-    url = f"https://www.googleapis.com/calendar/v3/calendars/primary/events?timeMin={now}"
+    url = f"{GOOGLE_CALENDAR_API}/calendars/{quote(calendar_id)}/events?timeMin={now}"
     headers = {
         "Authorization": f"Bearer {access_token}"
     }
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers) as response:
+    async with get_session().get(url, headers=headers) as response:
+        if response.status != 200:
+            error_message = await response.text()
+            print(f"Failed to fetch events, response status: {response.status}, error: {error_message}")
+            return None
+        response_data = await response.json()
+        return response_data.get("items", [])
+
+class CalendarSync:
+    """
+    One pass over a calendar's events.list, page by page.
+
+    With a sync token only changes since the last sync are returned;
+    without one, every event from today on. `pages()` yields each page's
+    events as soon as it arrives. If Google rejects the sync token (410) the
+    pass restarts as a full sync and `full_resync` is set; pages yielded
+    before that may be yielded again, so consumers must be idempotent.
+    Once `pages()` is exhausted, `next_sync_token` holds the token to store
+    for the next sync. Given the `refresh_token`, a 401 renews the access
+    token and retries the request once.
+    """
+
+    def __init__(self, access_token: str, sync_token: str = None, page_size: int = GOOGLE_SYNC_PAGE_SIZE, limiter=None,
+                 calendar_id: str = "primary", refresh_token: str = None):
+        self.url = f"{GOOGLE_CALENDAR_API}/calendars/{quote(calendar_id)}/events"
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.sync_token = sync_token
+        self.page_size = page_size
+        # Optional rate limiter with an async acquire(), awaited before each request
+        self.limiter = limiter
+        self.next_sync_token = None
+        self.full_resync = False
+
+    async def pages(self):
+        headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        sync_token = self.sync_token
+        renewed = False
+        while True:
+            params = {
+                "maxResults": self.page_size
+            }
+            if sync_token:
+                print("Performing incremental sync.")
+                params["syncToken"] = sync_token
+            else:
+                print("Performing full sync from today into the future.")
+                params["timeMin"] = datetime.utcnow().isoformat() + 'Z'
+
+            page_token = None
+            while True:
+                if page_token:
+                    params["pageToken"] = page_token
+
+                if self.limiter is not None:
+                    await self.limiter.acquire()
+                async with get_session().get(self.url, headers=headers, params=params) as response:
+                    if response.status == 410:
+                        break
+                    elif response.status == 401 and self.refresh_token and not renewed:
+                        renewed = True
+                        self.access_token = await renew_access_token(self.refresh_token, self.access_token)
+                        headers["Authorization"] = f"Bearer {self.access_token}"
+                        continue
+                    elif response.status != 200:
+                        error_message = await response.text()
+                        print(f"Failed to sync events, response status: {response.status}, error: {error_message}")
+                        raise Exception(f"Failed to sync events: {error_message}")
+                    response_data = await response.json()
+
+                yield response_data.get("items", [])
+                page_token = response_data.get("nextPageToken")
+                if not page_token:
+                    # Store the sync token from the last request to be used during the next execution.
+                    self.next_sync_token = response_data.get("nextSyncToken")
+                    print("Sync complete.")
+                    return
+
+            if not sync_token:
+                raise Exception("Failed to sync events: full sync was rejected with 410")
+            # Sync token is invalid, perform a full sync
+            print("Invalid sync token, clearing event store and re-syncing.")
+            sync_token = None
+            self.full_resync = True
+
+async def list_calendars(access_token: str, limiter=None, refresh_token: str = None) -> list:
+    """
+    Ids of the calendars on the user's calendar list whose events we can read.
+
+    The user's own calendar is returned as "primary", first, so it matches
+    the ids used for sync tokens and watch channels. Given the
+    `refresh_token`, a 401 renews the access token and retries once.
+    """
+    url = f"{GOOGLE_CALENDAR_API}/users/me/calendarList"
+    headers = {
+        "Authorization": f"Bearer {access_token}"
+    }
+    params = {"minAccessRole": "reader"}
+    calendar_ids = []
+    renewed = False
+    while True:
+        if limiter is not None:
+            await limiter.acquire()
+        async with get_session().get(url, headers=headers, params=params) as response:
+            if response.status == 401 and refresh_token and not renewed:
+                renewed = True
+                access_token = await renew_access_token(refresh_token, access_token)
+                headers["Authorization"] = f"Bearer {access_token}"
+                continue
             if response.status != 200:
                 error_message = await response.text()
-                print(f"Failed to fetch events, response status: {response.status}, error: {error_message}")
-                return None
+                raise Exception(f"Failed to list calendars: {response.status} {error_message}")
             response_data = await response.json()
-            return response_data.get("items", [])
+        for item in response_data.get("items", []):
+            if item.get("primary"):
+                calendar_ids.insert(0, "primary")
+            elif not item.get("deleted"):
+                calendar_ids.append(item["id"])
+        if not response_data.get("nextPageToken"):
+            return calendar_ids or ["primary"]
+        params["pageToken"] = response_data["nextPageToken"]
+
+def event_dedup_key(event: dict):
+    # Copies of one meeting on several calendars share an iCalUID; instances
+    # of a recurring meeting share it too but differ in originalStartTime
+    original_start = event.get("originalStartTime") or {}
+    return event.get("iCalUID") or event["id"], original_start.get("dateTime") or original_start.get("date")
+
+async def sync_calendars(access_token: str, user_id: str, sync_tokens: dict, limiter=None, force=False,
+                         refresh_token: str = None) -> dict:
+    """
+    Sync every calendar of the user, up to GOOGLE_CALENDAR_CONCURRENCY at a time.
+
+    Each calendar uses its own sync token from `sync_tokens` (calendar id ->
+    token). Pages are de-duplicated across calendars by iCalUID before
+    filtering, so a meeting on two calendars is persisted and scheduled once,
+    and then persisted as they arrive. A calendar that fails keeps its old
+    token and the others still complete. `force` is passed on to
+    persist_meet_events; `refresh_token` lets requests recover from a 401.
+
+    Returns {"calendars", "sync_tokens", "events", "errors"}; sync_tokens
+    only has entries for calendars still on the list.
+    """
+    calendar_ids = await list_calendars(access_token, limiter, refresh_token)
+    slots = asyncio.Semaphore(GOOGLE_CALENDAR_CONCURRENCY)
+    seen = set()
+
+    async def sync_one(calendar_id):
+        async with slots:
+            sync = CalendarSync(access_token, sync_tokens.get(calendar_id), limiter=limiter, calendar_id=calendar_id,
+                                refresh_token=refresh_token)
+            count = 0
+            async for events in sync.pages():
+                count += len(events)
+                unique = []
+                for event in events:
+                    key = event_dedup_key(event)
+                    if key not in seen:
+                        seen.add(key)
+                        unique.append(event)
+                # Extract each event's meeting link once; events without one are dropped here
+                await persist_meet_events(user_id, unique, meeting_links(unique), force=force)
+            return sync.next_sync_token, count
+
+    results = await asyncio.gather(*[sync_one(calendar_id) for calendar_id in calendar_ids], return_exceptions=True)
+    new_tokens = {}
+    errors = {}
+    total = 0
+    for calendar_id, result in zip(calendar_ids, results):
+        if isinstance(result, BaseException):
+            print(f"Failed to sync calendar {calendar_id}: {result}")
+            errors[calendar_id] = str(result)
+            token = sync_tokens.get(calendar_id)
+        else:
+            token, count = result
+            total += count
+        if token:
+            new_tokens[calendar_id] = token
+    return {"calendars": calendar_ids, "sync_tokens": new_tokens, "events": total, "errors": errors}
 
 async def sync_google_calendar_events(access_token: str, sync_token: str = None):
-    print("Starting Google Calendar sync")
-    url = "https://www.googleapis.com/calendar/v3/calendars/primary/events"
-    headers = {
-        "Authorization": f"Bearer {access_token}"
-    }
-    params = {
-        "maxResults": 10000
-    }
-    
-    if sync_token:
-        print("Performing incremental sync.")
-        params["syncToken"] = sync_token
+    """Collect every page of a CalendarSync; returns (events, next_sync_token)."""
+    sync = CalendarSync(access_token, sync_token)
+    events = []
+    async for page in sync.pages():
+        events.extend(page)
+    return events, sync.next_sync_token
+
+def cron_link_for(provider: str) -> str:
+    base_url = os.getenv("SERVER_ENDPOINT")
+    if provider == "zoom":
+        return base_url + "/join-zoom"
+    elif provider == "teams":
+        return base_url + "/join-teams"
     else:
-        print("Performing full sync from today into the future.")
-        today = datetime.utcnow().isoformat() + 'Z'
-        params["timeMin"] = today
+        return base_url + "/join-meet"
 
-    page_token = None
-    events = []
-    while True:
-        if page_token:
-            params["pageToken"] = page_token
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params) as response:
-                if response.status == 410:
-                    # Sync token is invalid, perform a full sync
-                    print("Invalid sync token, clearing event store and re-syncing.")
-                    return await sync_google_calendar_events(access_token)
-                elif response.status != 200:
-                    error_message = await response.text()
-                    print(f"Failed to sync events, response status: {response.status}, error: {error_message}")
-                    raise Exception(f"Failed to sync events: {error_message}")
-
-                response_data = await response.json()
-                events.extend(response_data.get("items", []))
-                page_token = response_data.get("nextPageToken")
-                if not page_token:
-                    break
 
-    # Store the sync token from the last request to be used during the next execution.
-    new_sync_token = response_data.get("nextSyncToken")
-    print("Sync complete.")
-    return events, new_sync_token
+async def persist_meet_events(user_id: str, events: list, meet_events: list, force: bool = False):
+    """
+    Write a sync's results with one calevents upsert and one cron batch.
 
+    `meet_events` holds the (event, MeetingLink) pairs from meeting_links().
+    Meet events are upserted and scheduled; every other event returned by the
+    sync (cancelled, or without a meeting link) is deleted from calevents.
+    Events whose fingerprint matches the stored one are skipped entirely,
+    unless `force` is set: then every meet event is rewritten and its cron job
+    re-created, e.g. after cron jobs were lost.
+    """
+    existing = await db.get_event_fingerprints([event['id'] for event in events])
 
-async def setup_event_subscriptions(access_token: str, user_id: str):
-    print("Creating a new event subscription")
-    unique_channel_id = str(uuid.uuid4())  # Generate a unique channel ID
-    watch_url = "https://www.googleapis.com/calendar/v3/calendars/primary/events/watch"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "id": unique_channel_id,
-        "type": "web_hook",
-        "address": os.getenv('SERVER_ENDPOINT') + "/gcal-notifications",
-        "token": user_id
-    }
+    rows = []
+    tasks = []
+    skipped = 0
+    for event, meeting_link in meet_events:
+        fingerprint = event_fingerprint(event, meeting_link.url)
+        if not force and existing.get(event['id']) == fingerprint:
+            skipped += 1
+            continue
+
+        event_data = {
+            "user_id": user_id,
+            "event_id": event['id'],
+            "summary": event.get('summary', ''),
+            "description": event.get('description', ''),
+            "start_time": event['start']['dateTime'],
+            "end_time": event['end']['dateTime'],
+            "link": meeting_link.url,
+            "attendees": json.dumps([attendee['email'] for attendee in event.get('attendees', [])]),
+        }
+        rows.append({**event_data, "fingerprint": fingerprint})
+
+        tasks.append(build_cron_task(
+            task_id=event['id'],
+            run_time=event['start']['dateTime'],
+            link=cron_link_for(meeting_link.provider),
+            headers={"Content-Type": "application/json"},
+            body={
+                "meet_link": meeting_link.url,
+                "end_time": int((parser.isoparse(event['end']['dateTime']) - parser.isoparse(event['start']['dateTime'])).total_seconds() / 60),
+                "user_id": user_id,
+                "event_data": event_data
+            }
+        ))
+
+    # Schedule before storing fingerprints, so a failed cron call is retried on the next sync
+    await upsert_cron_jobs(tasks)
+    await db.upsert_calevents(rows)
+
+    # Delete any non-meet or canceled events that are still stored
+    meet_event_ids = {event['id'] for event, _ in meet_events if event.get('status') != 'cancelled'}
+    non_meet_event_ids = [event['id'] for event in events if event['id'] not in meet_event_ids and event['id'] in existing]
+    if non_meet_event_ids:
+        await db.delete_calevents(non_meet_event_ids)
+
+    write_stats["events_written"] += len(rows)
+    write_stats["events_skipped"] += skipped
+    write_stats["events_deleted"] += len(non_meet_event_ids)
+    print(f"Upserted {len(rows)} events, skipped {skipped} unchanged, deleted {len(non_meet_event_ids)}")
+
+
+async def sync_user_calendar(user_id: str, full: bool = False, limiter=None):
+    """
+    Incrementally sync all of a user's calendars from their stored sync tokens.
+
+    Meet events are upserted into calevents and scheduled with the cron
+    server; cancelled and non-meeting events are removed. `full` ignores the
+    stored token, syncs everything from today on and re-creates the cron job
+    of every meet event, changed or not; `limiter` is passed on to
+    CalendarSync.
+    """
+    # Fetch the Google refresh token and sync token from the 'integrations' table using the user_id
+    print(f"Fetching Google tokens for user_id: {user_id}")
+    integration = await db.get_integration(user_id, "google_token", "google_sync_token", "google_sync_tokens")
+    if not integration:
+        print("Google tokens not found for the given user_id.")
+        raise Exception("Google tokens not found for the given user_id")
+
+    google_refresh_token = integration['google_token']['refresh_token']
+    sync_tokens = dict(integration.get('google_sync_tokens') or {})
+    # Tokens stored before per-calendar sync only covered the primary calendar
+    if integration.get('google_sync_token'):
+        sync_tokens.setdefault("primary", integration['google_sync_token'])
+    if full:
+        sync_tokens = {}
+    print("Google tokens retrieved successfully.")
+
+    # Use the refresh token to get a new access token
+    print("Obtaining new access token using the refresh token.")
+    access_token = await get_access_token_from_refresh_token(google_refresh_token)
+    if not access_token:
+        print("Failed to obtain access token.")
+        raise Exception("Failed to obtain access token")
+    print("Access token obtained successfully.")
+
+    # Sync every calendar from its own token, persisting each page as it arrives
+    print("Performing sync using the sync tokens.")
+    result = await sync_calendars(access_token, user_id, sync_tokens, limiter=limiter, force=full,
+                                  refresh_token=google_refresh_token)
+    # Only advance a calendar's token once every page of it has been persisted
+    await db.update_integration(user_id, {
+        "google_sync_tokens": result["sync_tokens"],
+        "google_sync_token": result["sync_tokens"].get("primary")
+    })
+    if result["errors"]:
+        raise Exception(f"Failed to sync calendars: {result['errors']}")
+    print("Sync completed successfully.")
+    print('Events with valid meeting links upserted/updated in Supabase successfully.')
 
-    async with aiohttp.ClientSession() as session:
-        # Setting up a new event subscription
-        async with session.post(watch_url, headers=headers, json=data) as response:
-            response_data = await response.json()
-            if response.status != 200:
-                error_message = response_data.get("error", {}).get("message", "Unknown error")
-                print(f"Failed to create event subscription, response status: {response.status}, error: {error_message}")
-                raise Exception(f"Failed to create event subscription: {error_message}")
-            else:
-                print("Event subscription created successfully")
-                print(f"New subscription set for channel ID: {unique_channel_id}")
\ No newline at end of file
@@ -0,0 +1,194 @@
+import argparse
+import contextlib
+import html
+import os
+import random
+import re
+import time
+from collections import namedtuple
+from urllib.parse import unquote
+
+# provider: "zoom", "meet" or "teams"; meeting_id: the provider's id for the
+# meeting; url: canonical join URL (https, lower-case host, tracking stripped)
+MeetingLink = namedtuple("MeetingLink", ["provider", "meeting_id", "url"])
+
+# Provider hosts, compiled once. Searched case-sensitively in lower-cased text,
+# which lets the regex engine skip ahead on literals; each hit is then parsed
+# with an anchored per-provider pattern
+MEETING_HOST_PATTERN = re.compile(r"zoom(?:gov)?\.(?:us|com)/|meet\.google\.com/|teams\.(?:microsoft|live)\.com/")
+ZOOM_PATH_PATTERN = re.compile(r"(?P<kind>j|my|w|s|wc/join)/(?P<id>[\w.-]+)(?:\?(?P<query>[^\s\"'<>]*))?", re.IGNORECASE)
+MEET_PATH_PATTERN = re.compile(r"(?P<id>[a-z]{3}-[a-z]{4}-[a-z]{3})\b", re.IGNORECASE)
+# Any other meet.google.com path, e.g. lookup/<name> links; kept as written
+MEET_ANY_PATH_PATTERN = re.compile(r"[^\s\"'<>]+")
+TEAMS_PATH_PATTERN = re.compile(r"(?:l/meetup-join/(?P<thread>[^\s\"'<>/]+)|meet/(?P<live>[^\s\"'<>/?]+))[^\s\"'<>]*", re.IGNORECASE)
+ZOOM_PASSCODE_PATTERN = re.compile(r"(?:^|&)pwd=([^&#]+)")
+# Characters allowed in a zoom subdomain, e.g. us02web.zoom.us
+HOST_CHARS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.-_")
+
+# Trailing characters that belong to the surrounding text, not the URL
+URL_TRAILING = ".,;:!)]>'\""
+
+
+def parse_meeting_url(text):
+    """The first meeting link in `text`, normalized, or None."""
+    if not text:
+        return None
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        # Some non-ASCII character changed length when lower-cased; offsets
+        # would no longer line up, so only lower-case hosts are found
+        lowered = text
+    for host_match in MEETING_HOST_PATTERN.finditer(lowered):
+        host = host_match.group(0)
+        path_start = host_match.end()
+
+        if host.startswith("meet."):
+            match = MEET_PATH_PATTERN.match(text, path_start)
+            if match:
+                meeting_id = match.group("id").lower()
+                return MeetingLink("meet", meeting_id, f"https://meet.google.com/{meeting_id}")
+            match = MEET_ANY_PATH_PATTERN.match(text, path_start)
+            path = html.unescape(match.group(0)).rstrip(URL_TRAILING) if match else ""
+            if path:
+                return MeetingLink("meet", path.split("?")[0], f"https://meet.google.com/{path}")
+
+        elif host.startswith("teams."):
+            match = TEAMS_PATH_PATTERN.match(text, path_start)
+            if match:
+                url = "https://" + html.unescape(text[host_match.start():match.end()]).rstrip(URL_TRAILING)
+                return MeetingLink("teams", unquote(match.group("thread") or match.group("live")), url)
+
+        else:
+            match = ZOOM_PATH_PATTERN.match(text, path_start)
+            if match:
+                # Include the subdomain, if any, in the host
+                start = host_match.start()
+                while start > 0 and text[start - 1] in HOST_CHARS:
+                    start -= 1
+                zoom_host = text[start:path_start - 1].lstrip(".").lower()
+                kind = match.group("kind").lower()
+                meeting_id = match.group("id").rstrip(URL_TRAILING)
+                url = f"https://{zoom_host}/{'j' if kind in ('s', 'wc/join') else kind}/{meeting_id}"
+                # The passcode is needed to join; everything else in the query is tracking
+                passcode = ZOOM_PASSCODE_PATTERN.search(html.unescape(match.group("query") or ""))
+                if passcode:
+                    url += f"?pwd={passcode.group(1).rstrip(URL_TRAILING)}"
+                return MeetingLink("zoom", meeting_id, url)
+    return None
+
+
+def extract_meeting_link(event):
+    """
+    Find the meeting link of a Google Calendar event, or None.
+
+    Looks at hangoutLink, then conferenceData video entry points, then the
+    description and location, and stops at the first match.
+    """
+    link = parse_meeting_url(event.get("hangoutLink"))
+    if link:
+        return link
+    for entry_point in (event.get("conferenceData") or {}).get("entryPoints", []):
+        if entry_point.get("entryPointType") == "video":
+            link = parse_meeting_url(entry_point.get("uri"))
+            if link:
+                return link
+    return parse_meeting_url(event.get("description")) or parse_meeting_url(event.get("location"))
+
+
+def meeting_links(events):
+    """(event, MeetingLink) for every event that has a meeting link, extracted once per event."""
+    pairs = []
+    for event in events:
+        link = extract_meeting_link(event)
+        if link:
+            pairs.append((event, link))
+    return pairs
+
+
+def _synthetic_calendar(count, seed=0):
+    rng = random.Random(seed)
+    filler = "Agenda: quarterly planning, roadmap review and open questions. " * 8
+    events = []
+    for i in range(count):
+        event = {"id": f"event{i}", "iCalUID": f"event{i}@google.com", "summary": f"Meeting {i}",
+                 "start": {"dateTime": "2030-01-01T10:00:00Z"}, "end": {"dateTime": "2030-01-01T11:00:00Z"}}
+        kind = rng.random()
+        if kind < 0.3:
+            code = "".join(chr(97 + i // 26 ** k % 26) for k in range(3))
+            event["hangoutLink"] = f"https://meet.google.com/{code}-defg-hij"
+        elif kind < 0.45:
+            event["conferenceData"] = {"entryPoints": [
+                {"entryPointType": "video", "uri": f"https://us02web.zoom.us/j/{8_000_000_000 + i}?pwd=Secret{i}"},
+                {"entryPointType": "phone", "uri": "tel:+1-555-0100"}]}
+        elif kind < 0.6:
+            event["description"] = (f"{filler}<a href=\"https://zoom.us/j/{9_000_000_000 + i}?pwd=abc&amp;from=addon\">"
+                                    f"Join Zoom</a> {filler}")
+        elif kind < 0.7:
+            event["location"] = f"https://teams.microsoft.com/l/meetup-join/19%3ameeting_{i}%40thread.v2/0?context=%7b%7d"
+        else:
+            event["description"] = filler * 2
+            event["location"] = "Room 4B"
+        events.append(event)
+    return events
+
+
+def _legacy_get_meeting_link(event):
+    # The previous implementation: prints on every branch, pattern looked up on every call
+    if 'hangoutLink' in event and event['hangoutLink']:
+        print("Found hangoutLink:", event['hangoutLink'])
+        return event['hangoutLink']
+    meeting_url_pattern = re.compile(r'(http|www).*(zoom.us|meet.google.com|teams.microsoft)[a-z\/0-9?=A-Z.-]*')
+    if 'description' in event:
+        match = meeting_url_pattern.search(event['description'])
+        if match:
+            print("Found link in description:", match.group(0))
+            return match.group(0)
+    if 'location' in event:
+        match = meeting_url_pattern.search(event['location'])
+        if match:
+            print("Found link in location:", match.group(0))
+            return match.group(0)
+    print("No meeting link found.")
+    return ""
+
+
+def benchmark(count=100_000, quadratic_sample=5_000):
+    """Compare the previous extract/filter/re-extract flow with single-pass extraction."""
+    events = _synthetic_calendar(count)
+    print(f"{count} synthetic events")
+
+    # Legacy prints go to /dev/null, as they would to a log sink that isn't read
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        meet_events = [event for event in events if _legacy_get_meeting_link(event)]
+        links = [_legacy_get_meeting_link(event) for event in meet_events]
+    legacy = time.perf_counter() - start
+    print(f"legacy:      {legacy:.2f}s ({len(links)} links, extracted twice per meeting, no conferenceData)")
+
+    start = time.perf_counter()
+    pairs = meeting_links(events)
+    single = time.perf_counter() - start
+    providers = {}
+    for _, link in pairs:
+        providers[link.provider] = providers.get(link.provider, 0) + 1
+    print(f"single pass: {single:.2f}s ({len(pairs)} links: {providers}), {legacy / single:.1f}x faster")
+
+    # Non-meeting ids: list membership (dict equality per element) vs a set of ids
+    sample = events[:quadratic_sample]
+    sample_meet = [event for event, _ in meeting_links(sample)]
+    start = time.perf_counter()
+    slow = [event['id'] for event in sample if event not in sample_meet]
+    scan = time.perf_counter() - start
+    start = time.perf_counter()
+    meet_ids = {event['id'] for event in sample_meet}
+    fast = [event['id'] for event in sample if event['id'] not in meet_ids]
+    lookup = time.perf_counter() - start
+    assert slow == fast
+    print(f"non-meet ids over {quadratic_sample} events: list scan {scan:.3f}s, id set {lookup:.4f}s "
+          f"(the scan grows quadratically, ~{scan * (count / quadratic_sample) ** 2:.0f}s at {count})")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark meeting-link extraction")
+    arg_parser.add_argument("--events", type=int, default=100_000, help="size of the synthetic calendar")
+    benchmark(arg_parser.parse_args().events)
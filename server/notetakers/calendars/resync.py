@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from dotenv import load_dotenv
+from .google import sync_user_calendar
+from .. import db
+from ..http_client import http_client
+
+load_dotenv(dotenv_path='@.env')
+
+# Users synced at the same time
+RESYNC_CONCURRENCY = int(os.getenv("RESYNC_CONCURRENCY", "8"))
+# Google Calendar API requests per second across the whole run, and the burst allowed
+RESYNC_RATE_PER_SECOND = float(os.getenv("RESYNC_RATE_PER_SECOND", "10"))
+RESYNC_BURST = int(os.getenv("RESYNC_BURST", "20"))
+# Where finished users are recorded so an interrupted run can resume
+RESYNC_CHECKPOINT_PATH = os.getenv("RESYNC_CHECKPOINT_PATH", "calendar_resync.json")
+# The checkpoint is rewritten after this many users finish
+RESYNC_CHECKPOINT_EVERY = int(os.getenv("RESYNC_CHECKPOINT_EVERY", "25"))
+
+
+class TokenBucket:
+    """Async token-bucket rate limiter: `rate` acquisitions per second with bursts up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class FleetResync:
+    """
+    Re-sync the calendars of every connected user.
+
+    Users are synced `concurrency` at a time and all Google Calendar requests
+    share one token bucket. Finished users are written to a JSON checkpoint
+    every `checkpoint_every` completions and at the end; a new run with the
+    same checkpoint skips them, so an interrupted run resumes where it left
+    off. Failed users are recorded with their error and retried on the next
+    run; once a run finishes without failures the checkpoint is removed.
+    With `full`, every meet event's cron job is re-created, which recovers
+    jobs lost by the cron server. Syncs are idempotent, so a webhook-triggered
+    sync of the same user running at the same time only costs duplicate work.
+    """
+
+    def __init__(self, concurrency=RESYNC_CONCURRENCY, rate=RESYNC_RATE_PER_SECOND, burst=RESYNC_BURST,
+                 checkpoint_path=RESYNC_CHECKPOINT_PATH, checkpoint_every=RESYNC_CHECKPOINT_EVERY,
+                 full=False, sync=sync_user_calendar, list_users=db.list_google_user_ids):
+        self.concurrency = concurrency
+        self.limiter = TokenBucket(rate, burst)
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.full = full
+        self._sync = sync
+        self._list_users = list_users
+        self._done = set()
+        self._failed = {}
+        self._progress = {"state": "idle", "total": 0, "skipped": 0, "succeeded": 0, "failed": 0,
+                          "started_at": None, "finished_at": None}
+
+    async def run(self):
+        """Sync every user not already in the checkpoint; returns the final progress."""
+        self._load_checkpoint()
+        self._progress.update(state="running", started_at=time.time(), finished_at=None,
+                              succeeded=0, failed=0)
+        user_ids = await self._list_users()
+        pending = [user_id for user_id in user_ids if user_id not in self._done]
+        self._progress.update(total=len(user_ids), skipped=len(user_ids) - len(pending))
+        print(f"Resyncing {len(pending)} of {len(user_ids)} users, {self.concurrency} at a time")
+
+        queue = asyncio.Queue()
+        for user_id in pending:
+            queue.put_nowait(user_id)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+            self._progress["state"] = "finished"
+        except BaseException:
+            for worker in workers:
+                worker.cancel()
+            self._progress["state"] = "interrupted"
+            raise
+        finally:
+            self._progress["finished_at"] = time.time()
+            self._save_checkpoint()
+        if not self._failed and self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            # Everyone is in sync; the next run starts from scratch
+            os.remove(self.checkpoint_path)
+        return self.progress()
+
+    def progress(self):
+        progress = dict(self._progress)
+        finished = progress["succeeded"] + progress["failed"]
+        remaining = progress["total"] - progress["skipped"] - finished
+        elapsed = (progress["finished_at"] or time.time()) - progress["started_at"] if progress["started_at"] else 0
+        rate = finished / elapsed if elapsed else 0
+        progress.update(remaining=remaining, users_per_second=round(rate, 2),
+                        eta_seconds=round(remaining / rate) if rate else None)
+        return progress
+
+    async def _worker(self, queue):
+        while not queue.empty():
+            user_id = queue.get_nowait()
+            try:
+                await self._sync(user_id, full=self.full, limiter=self.limiter)
+                self._done.add(user_id)
+                self._failed.pop(user_id, None)
+                self._progress["succeeded"] += 1
+            except Exception as e:
+                self._failed[user_id] = str(e)
+                self._progress["failed"] += 1
+                print(f"Resync failed for user {user_id}: {e}")
+
+            finished = self._progress["succeeded"] + self._progress["failed"]
+            if finished % self.checkpoint_every == 0:
+                self._save_checkpoint()
+                progress = self.progress()
+                print(f"Resync progress: {finished}/{progress['total'] - progress['skipped']} "
+                      f"({progress['failed']} failed, eta {progress['eta_seconds']}s)")
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        self._done = set(checkpoint.get("done", []))
+        self._failed = checkpoint.get("failed", {})
+        print(f"Resuming resync from {self.checkpoint_path}: {len(self._done)} users already done")
+
+    def _save_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        # Write then rename, so a crash never leaves a half-written checkpoint
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"done": sorted(self._done), "failed": self._failed}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Re-sync the calendars of every connected user")
+    arg_parser.add_argument("--concurrency", type=int, default=RESYNC_CONCURRENCY, help="users synced at the same time")
+    arg_parser.add_argument("--rate", type=float, default=RESYNC_RATE_PER_SECOND, help="Google API requests per second")
+    arg_parser.add_argument("--burst", type=int, default=RESYNC_BURST, help="Google API request burst size")
+    arg_parser.add_argument("--checkpoint", default=RESYNC_CHECKPOINT_PATH, help="checkpoint file to resume from")
+    arg_parser.add_argument("--full", action="store_true", help="ignore stored sync tokens, sync from today on and re-create every cron job")
+    args = arg_parser.parse_args()
+
+    async def main():
+        try:
+            resync = FleetResync(args.concurrency, args.rate, args.burst, args.checkpoint, full=args.full)
+            print(json.dumps(await resync.run()))
+        finally:
+            await http_client.close()
+            db.database.close()
+
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path='@.env')
+
+# Number of users whose access tokens are kept in memory
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# Refresh this long before Google says the token expires
+TOKEN_EXPIRY_MARGIN_SECONDS = int(os.getenv("TOKEN_EXPIRY_MARGIN_SECONDS", "300"))
+
+
+class AccessTokenCache:
+    """
+    LRU cache of Google access tokens keyed by refresh token.
+
+    Tokens are reused until `expires_in` minus a safety margin. Refreshes are
+    single-flight: concurrent callers for the same user wait on one exchange
+    instead of each hitting oauth2.googleapis.com. Refresh tokens are only
+    kept as SHA-256 digests.
+    """
+
+    def __init__(self, exchange, max_size=TOKEN_CACHE_SIZE, margin=TOKEN_EXPIRY_MARGIN_SECONDS):
+        self._exchange = exchange
+        self.max_size = max_size
+        self.margin = margin
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._counters = {"hits": 0, "misses": 0, "coalesced": 0, "refreshes": 0, "failures": 0, "evictions": 0,
+                          "invalidations": 0}
+
+    @staticmethod
+    def key(refresh_token):
+        return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+    async def get(self, refresh_token):
+        key = self.key(refresh_token)
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.time():
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[0]
+
+        self._counters["misses"] += 1
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._counters["coalesced"] += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        # Nobody else may be waiting; don't warn about an unretrieved exception
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            self._counters["refreshes"] += 1
+            access_token, expires_in = await self._exchange(refresh_token)
+            if access_token:
+                self._store(key, access_token, expires_in)
+            else:
+                self._counters["failures"] += 1
+            future.set_result(access_token)
+            return access_token
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            self._counters["failures"] += 1
+            future.set_exception(e)
+            raise
+        finally:
+            del self._inflight[key]
+
+    def invalidate(self, refresh_token, access_token=None):
+        """
+        Forget a token Google has rejected, so the next call refreshes it.
+
+        With `access_token`, the entry is only dropped while it still holds
+        that token; callers that all got the same 401 then share one refresh.
+        """
+        key = self.key(refresh_token)
+        entry = self._entries.get(key)
+        if entry is not None and (access_token is None or entry[0] == access_token):
+            del self._entries[key]
+            self._counters["invalidations"] += 1
+
+    def stats(self):
+        return {"size": len(self._entries), "max_size": self.max_size, **self._counters}
+
+    def _store(self, key, access_token, expires_in):
+        self._entries[key] = (access_token, time.time() + max(int(expires_in or 0) - self.margin, 0))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
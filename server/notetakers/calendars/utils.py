@@ -1,5 +1,7 @@
 
-import re
+import hashlib
+import json
+from .links import extract_meeting_link, meeting_links
 
 def filter_meeting_events(events):
     """
@@ -11,35 +13,30 @@ def filter_meeting_events(events):
     Returns:
         list: A list of events that contain a meeting link.
     """
-    
-    return [
-        event for event in events
-        if get_meeting_link(event)
-    ]
+    return [event for event, _ in meeting_links(events)]
 
 def get_meeting_link(event):
-    # Check for 'hangoutLink' in the event
-    if 'hangoutLink' in event and event['hangoutLink']:
-        print("Found hangoutLink:", event['hangoutLink'])
-        return event['hangoutLink']
-    
-    # Define a regex pattern to match valid meeting URLs, allowing optional query parameters
-    meeting_url_pattern = re.compile(r'(http|www).*(zoom.us|meet.google.com|teams.microsoft)[a-z\/0-9?=A-Z.-]*')
-    
-    # Check for a meeting link in the 'description'
-    if 'description' in event:
-        match = meeting_url_pattern.search(event['description'])
-        if match:
-            print("Found link in description:", match.group(0))
-            return match.group(0)
-    
-    # Check for a meeting link in the 'location'
-    if 'location' in event:
-        match = meeting_url_pattern.search(event['location'])
-        if match:
-            print("Found link in location:", match.group(0))
-            return match.group(0)
-    
-    # Return an empty string if no meeting link is found
-    print("No meeting link found.")
-    return ""
+    """
+    Returns the canonical meeting URL of an event, or an empty string if it has none.
+
+    Prefer links.extract_meeting_link when the provider or meeting id is needed too.
+    """
+    link = extract_meeting_link(event)
+    return link.url if link else ""
+
+
+def event_fingerprint(event, meeting_link):
+    """
+    Hash of the event fields that affect the calevent row and the bot's cron job.
+
+    Two syncs of an unchanged event give the same fingerprint, so the write
+    can be skipped.
+    """
+    content = [
+        event.get('start', {}).get('dateTime'),
+        event.get('end', {}).get('dateTime'),
+        meeting_link,
+        sorted(attendee.get('email', '') for attendee in event.get('attendees', [])),
+        event.get('status')
+    ]
+    return hashlib.sha1(json.dumps(content).encode()).hexdigest()
@@ -0,0 +1,220 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from supabase import create_client, Client
+
+load_dotenv(dotenv_path='@.env')
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+# Threads running Supabase requests; also caps concurrent requests per process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "16"))
+# Rows per calevents request; a sync normally fits in one
+CALEVENTS_BATCH_SIZE = int(os.getenv("CALEVENTS_BATCH_SIZE", "500"))
+
+
+class Database:
+    """
+    The process-wide Supabase client, used off the event loop.
+
+    supabase-py's client is synchronous, so every query runs on a dedicated
+    thread pool and is awaited; the event loop never blocks on a round-trip.
+    All queries share one client and therefore one HTTP connection pool.
+    Latency and error counts are kept per query name for /metrics. The
+    client is created on first use, so importing this module (e.g. in a
+    worker process) costs nothing.
+    """
+
+    def __init__(self, max_workers=DB_POOL_SIZE):
+        self.max_workers = max_workers
+        self._client = None
+        self._executor = None
+        # query name -> {"count", "errors", "total_seconds", "max_seconds"}
+        self._queries = {}
+
+    @property
+    def client(self) -> Client:
+        if self._client is None:
+            self._client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        return self._client
+
+    async def run(self, name, query):
+        """Run `query(client)` on the database thread pool and return its result."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="supabase")
+        start = time.perf_counter()
+        failed = False
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, query, self.client)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._record(name, time.perf_counter() - start, failed)
+
+    def stats(self):
+        return {
+            name: {
+                "count": stats["count"],
+                "errors": stats["errors"],
+                "avg_ms": round(stats["total_seconds"] / stats["count"] * 1000, 1),
+                "max_ms": round(stats["max_seconds"] * 1000, 1)
+            }
+            for name, stats in self._queries.items()
+        }
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _record(self, name, elapsed, failed):
+        stats = self._queries.setdefault(name, {"count": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        stats["count"] += 1
+        stats["errors"] += failed
+        stats["total_seconds"] += elapsed
+        stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+
+database = Database()
+
+
+def _batches(items, size=CALEVENTS_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+# ---- meetings ----
+
+async def insert_meeting(data):
+    return await database.run("meetings.insert", lambda client: client.table("meetings").insert(data).execute())
+
+
+# ---- integrations ----
+
+async def get_integration(user_id, *columns):
+    """The user's integrations row with the given columns, or None."""
+    response = await database.run(
+        "integrations.get",
+        lambda client: client.table("integrations").select(*columns).eq("user_id", user_id).execute()
+    )
+    return response.data[0] if response.data else None
+
+
+async def update_integration(user_id, values):
+    await database.run(
+        "integrations.update",
+        lambda client: client.table("integrations").update(values).eq("user_id", user_id).execute()
+    )
+
+
+async def list_google_user_ids(page_size=1000):
+    """Every user_id in integrations with a Google token, read page by page."""
+    user_ids = []
+    start = 0
+    while True:
+        response = await database.run(
+            "integrations.list",
+            lambda client: client.table("integrations").select("user_id")
+            .not_.is_("google_token", "null")
+            .order("user_id")
+            .range(start, start + page_size - 1)
+            .execute()
+        )
+        user_ids.extend(row["user_id"] for row in response.data)
+        if len(response.data) < page_size:
+            return user_ids
+        start += page_size
+
+
+# ---- calevents ----
+
+async def get_event_fingerprints(event_ids):
+    """Stored fingerprints of the given events that exist in calevents, keyed by event_id."""
+    fingerprints = {}
+    for batch in _batches(event_ids):
+        response = await database.run(
+            "calevents.fingerprints",
+            lambda client: client.table("calevents").select("event_id", "fingerprint").in_("event_id", batch).execute()
+        )
+        for row in response.data:
+            fingerprints[row["event_id"]] = row.get("fingerprint")
+    return fingerprints
+
+
+async def upsert_calevents(rows):
+    for batch in _batches(rows):
+        await database.run(
+            "calevents.upsert",
+            lambda client: client.table("calevents").upsert(batch, on_conflict="event_id").execute()
+        )
+
+
+async def delete_calevents(event_ids):
+    for batch in _batches(event_ids):
+        await database.run(
+            "calevents.delete",
+            lambda client: client.table("calevents").delete().in_("event_id", batch).execute()
+        )
+
+
+# ---- calendar_channels ----
+
+async def list_channels(page_size=1000):
+    """Every calendar_channels row, read page by page (PostgREST caps unpaged selects)."""
+    rows = []
+    start = 0
+    while True:
+        response = await database.run(
+            "calendar_channels.list",
+            lambda client: client.table("calendar_channels").select("*")
+            .order("channel_id")
+            .range(start, start + page_size - 1)
+            .execute()
+        )
+        rows.extend(response.data)
+        if len(response.data) < page_size:
+            return rows
+        start += page_size
+
+
+async def get_channel(channel_id):
+    response = await database.run(
+        "calendar_channels.get",
+        lambda client: client.table("calendar_channels").select("*").eq("channel_id", channel_id).execute()
+    )
+    return response.data[0] if response.data else None
+
+
+async def list_user_channels(user_id):
+    response = await database.run(
+        "calendar_channels.list_user",
+        lambda client: client.table("calendar_channels").select("*").eq("user_id", user_id).execute()
+    )
+    return response.data
+
+
+async def upsert_channel(row):
+    await database.run(
+        "calendar_channels.upsert",
+        lambda client: client.table("calendar_channels").upsert(row, on_conflict="channel_id").execute()
+    )
+
+
+async def delete_channel(channel_id):
+    await database.run(
+        "calendar_channels.delete",
+        lambda client: client.table("calendar_channels").delete().eq("channel_id", channel_id).execute()
+    )
+
+
+# ---- storage ----
+
+async def upload_screenshot(filename, data):
+    return await database.run(
+        "storage.screenshots.upload",
+        lambda client: client.storage.from_('screenshots').upload(filename, data, {"content-type": "image/png"})
+    )
@@ -1,49 +1,25 @@
 import asyncio
 import os
 import random
-import subprocess
-from io import BytesIO
-from PIL import Image
 from dotenv import load_dotenv
-from playwright.async_api import async_playwright
-from pyvirtualdisplay import Display
 from fastapi import HTTPException
-from supabase import create_client, Client
 import time
+from .. import db
+from .pool import browser_pool
+from .screenshots import ScreenshotUploader
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Supabase client
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+screenshot_uploader = ScreenshotUploader(db.upload_screenshot)
 
-# Function to set up virtual audio devices
-def setup_virtual_audio_devices():
-    try:
-        print("Setting up virtual audio devices...")
-        subprocess.check_output('pactl load-module module-null-sink sink_name=CustomOutput', shell=True)
-        subprocess.check_output('pactl load-module module-null-sink sink_name=CustomMicOutput', shell=True)
-        subprocess.check_output('pactl set-default-source CustomMicOutput.monitor', shell=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error setting up virtual audio: {e}")
-        raise HTTPException(status_code=500, detail="Failed to set up virtual audio devices.")
-
-# Function to upload image to Supabase
-def upload_image_to_supabase(image, filename):
-    buffer = BytesIO()
-    image.save(buffer, format="PNG")
-    buffer.seek(0)
-    # Convert BytesIO to bytes for upload
-    response = supabase.storage.from_('screenshots').upload(filename, buffer.getvalue(), {"content-type": "image/png"})
-    return response
-
-# Function to capture and upload a screenshot
-async def capture_and_upload_screenshot(page, step_name):
+# Function to capture a screenshot and queue it for upload in the background.
+# `level` is "key" for join milestones and "debug" for every other step.
+async def capture_and_upload_screenshot(page, step_name, level="debug"):
+    if not screenshot_uploader.should_capture(level):
+        return
     screenshot = await page.screenshot(type='png')
-    image = Image.open(BytesIO(screenshot))
-    upload_image_to_supabase(image, f"{step_name}_{int(time.time())}.png")
+    screenshot_uploader.submit(f"{step_name}_{int(time.time())}.png", screenshot)
 
 # Google sign-in function
 async def google_sign_in(email, password, page):
@@ -56,54 +32,137 @@ async def google_sign_in(email, password, page):
     await capture_and_upload_screenshot(page, "password_entered")
     await page.keyboard.press("Enter")
     await page.wait_for_load_state('networkidle')
-    await capture_and_upload_screenshot(page, "login_successful")
+    await capture_and_upload_screenshot(page, "login_successful", level="key")
+
+# Caption capture mode: "observer" pushes caption deltas from an in-page
+# MutationObserver, "poll" falls back to scraping the caption DOM every 2 seconds
+CAPTION_CAPTURE_MODE = os.getenv("CAPTION_CAPTURE_MODE", "observer")
+# How long the in-page observer batches caption updates before pushing them to Python
+CAPTION_FLUSH_MS = int(os.getenv("CAPTION_FLUSH_MS", "1000"))
+
+CAPTION_OBSERVER_SCRIPT = """
+(flushMs) => {
+    if (window.__captionObserver) return;
+    const lastText = new WeakMap();
+    let pending = new Set();
+    let timer = null;
+
+    const flush = () => {
+        timer = null;
+        const entries = [];
+        pending.forEach((element) => {
+            const nameNode = element.querySelector(".KcIKyf");
+            const textNode = element.querySelector(".bh44bd");
+            if (!nameNode || !textNode) return;
+            const text = textNode.innerText;
+            if (!text || lastText.get(element) === text) return;
+            lastText.set(element, text);
+            entries.push([nameNode.innerText, text, Date.now()]);
+        });
+        pending = new Set();
+        if (entries.length) window.__onCaptions(entries);
+    };
+    window.__flushCaptions = flush;
+
+    window.__captionObserver = new MutationObserver((mutations) => {
+        for (const mutation of mutations) {
+            const node = mutation.target.nodeType === Node.ELEMENT_NODE
+                ? mutation.target
+                : mutation.target.parentElement;
+            const element = node && node.closest(".a4cQT .nMcdL");
+            if (element) {
+                pending.add(element);
+                continue;
+            }
+            mutation.addedNodes.forEach((added) => {
+                if (added.nodeType !== Node.ELEMENT_NODE) return;
+                added.querySelectorAll(".a4cQT .nMcdL").forEach((el) => pending.add(el));
+            });
+        }
+        if (pending.size && timer === null) timer = setTimeout(flush, flushMs);
+    });
+    window.__captionObserver.observe(document.body, {
+        childList: true,
+        subtree: true,
+        characterData: true
+    });
+}
+"""
+
+# Push-based caption capture: a MutationObserver in the page batches caption
+# changes and sends them through a single exposed binding. Falls back to
+# polling if the observer cannot be installed.
+async def capture_captions_observer(page, deadline):
+    transcript = []
+
+    def on_captions(entries):
+        for person_name, transcript_text, timestamp_ms in entries:
+            transcript.append({
+                "personName": person_name,
+                "timeStamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp_ms / 1000)),
+                "transcriptText": transcript_text
+            })
+            print(f"New transcript: {transcript_text}")
+
+    try:
+        await page.expose_function("__onCaptions", on_captions)
+        await page.evaluate(CAPTION_OBSERVER_SCRIPT, CAPTION_FLUSH_MS)
+    except Exception as e:
+        print(f"Could not install the caption observer, polling instead: {e}")
+        return await capture_captions_polling(page, deadline)
+
+    try:
+        while time.time() < deadline:
+            await asyncio.sleep(min(5, max(deadline - time.time(), 0)))
+            # Re-install the observer if the page navigated or re-rendered
+            installed = await page.evaluate("() => !!window.__captionObserver")
+            if not installed:
+                print("Caption observer missing, re-installing")
+                await page.evaluate(CAPTION_OBSERVER_SCRIPT, CAPTION_FLUSH_MS)
+
+        # Push whatever is still buffered in the page
+        await page.evaluate("() => window.__flushCaptions && window.__flushCaptions()")
+    except Exception as e:
+        print(f"An error occurred while capturing the transcript: {e}")
+
+    return transcript
+
+# Poll-based caption capture, used with CAPTION_CAPTURE_MODE=poll and when the observer cannot be installed
+async def capture_captions_polling(page, deadline):
+    transcript = []
+    last_transcript = ""
+    try:
+        while time.time() < deadline:
+            await asyncio.sleep(2)
+            transcript_elements = await page.query_selector_all(".a4cQT .nMcdL")
+            for element in transcript_elements:
+                try:
+                    person_name = await page.evaluate('(element) => element.querySelector(".KcIKyf").innerText', element)
+                    transcript_text = await page.evaluate('(element) => element.querySelector(".bh44bd").innerText', element)
+                    if transcript_text != last_transcript:
+                        last_transcript = transcript_text
+                        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+                        transcript.append({
+                            "personName": person_name,
+                            "timeStamp": timestamp,
+                            "transcriptText": transcript_text
+                        })
+                        print(f"New transcript: {transcript_text}")
+                except Exception as e:
+                    print(f"An error occurred while processing transcript element: {e}")
+    except Exception as e:
+        print(f"An error occurred while capturing the transcript: {e}")
+
+    return transcript
 
 # Main function to join a Google Meet
 async def join_meet(meet_link, end_time=30):
     print(f"Starting recorder for {meet_link}")
-    setup_virtual_audio_devices()
-
-    # Virtual display for headless environment
-    display = Display(visible=0, size=(1920, 1080))
-    display.start()
-
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(
-            headless=False,
-            args=[
-                "--disable-blink-features=AutomationControlled",
-                "--use-fake-ui-for-media-stream",
-                "--use-fake-device-for-media-stream",
-                "--window-size=1920x1080",
-                "--no-sandbox",
-                "--disable-setuid-sandbox",
-                "--disable-gpu",
-                "--disable-extensions",
-                "--disable-application-cache",
-                "--disable-dev-shm-usage"
-            ]
-        )
-
-        context = await browser.new_context(
-            user_agent=random.choice([
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 " \
-                "(KHTML, like Gecko) Chrome/112.0.0.0 Safari/537.36"
-            ]),
-            locale="en-US",
-            timezone_id="America/Los_Angeles"
-        )
 
+    # Take a warm browser from the pool and get a fresh, isolated context for this meeting
+    async with browser_pool.context() as context:
         page = await context.new_page()
 
-        # Add stealth-like script
-        await page.add_init_script("""
-            Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
-            Object.defineProperty(navigator, 'plugins', { get: () => [1, 2, 3] });
-            Object.defineProperty(navigator, 'languages', { get: () => ['en-US', 'en'] });
-            window.chrome = { runtime: {} };
-            Object.defineProperty(navigator, 'hardwareConcurrency', { get: () => 4 });
-            Object.defineProperty(navigator, 'deviceMemory', { get: () => 8 });
-        """)
         # Sign in to Google
         email = os.getenv("GMAIL_USER_EMAIL", "")
         password = os.getenv("GMAIL_USER_PASSWORD", "")
@@ -119,7 +178,7 @@ async def join_meet(meet_link, end_time=30):
             try:
                 await page.goto(meet_link)
                 print(f"Opened meet link: {meet_link}")
-                await capture_and_upload_screenshot(page, "meet_opened")
+                await capture_and_upload_screenshot(page, "meet_opened", level="key")
 
                 # Join Google Meet
                 got_it_button = await page.wait_for_selector("button.UywwFc-LgbsSe.UywwFc-LgbsSe-OWXEXe-dgl2Hf.IMT1Gf", timeout=10000)
@@ -159,7 +218,7 @@ async def join_meet(meet_link, end_time=30):
                     await join_now_button.click()
                 except Exception:
                     print("Join Now button not found")
-                await capture_and_upload_screenshot(page, "after_join_now_click")
+                await capture_and_upload_screenshot(page, "after_join_now_click", level="key")
                 break
 
             except Exception as e:
@@ -172,9 +231,6 @@ async def join_meet(meet_link, end_time=30):
 
         # Start capturing the transcript
         print("Start capturing transcript")
-        transcript = []
-        last_transcript = ""
-
         start_time = time.time()
 
         while True and (time.time() - start_time) < (end_time * 60):
@@ -194,39 +250,21 @@ async def join_meet(meet_link, end_time=30):
                 except Exception:
                     print("Captions button not found. Retrying...")
                 await asyncio.sleep(1)  # Wait for a short period before retrying
-        await capture_and_upload_screenshot(page, "after_captions_button")
-
-        try:
-            while (time.time() - start_time) < (end_time * 60):
-                await asyncio.sleep(2)
-                transcript_elements = await page.query_selector_all(".a4cQT .nMcdL")
-                for element in transcript_elements:
-                    try:
-                        person_name = await page.evaluate('(element) => element.querySelector(".KcIKyf").innerText', element)
-                        transcript_text = await page.evaluate('(element) => element.querySelector(".bh44bd").innerText', element)
-                        if transcript_text != last_transcript:
-                            last_transcript = transcript_text
-                            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-                            transcript.append({
-                                "personName": person_name,
-                                "timeStamp": timestamp,
-                                "transcriptText": transcript_text
-                            })
-                            print(f"New transcript: {transcript_text}")
-                    except Exception as e:
-                        print(f"An error occurred while processing transcript element: {e}")
-        except Exception as e:
-            print(f"An error occurred while capturing the transcript: {e}")
+        await capture_and_upload_screenshot(page, "after_captions_button", level="key")
+
+        deadline = start_time + end_time * 60
+        if CAPTION_CAPTURE_MODE == "poll":
+            transcript = await capture_captions_polling(page, deadline)
+        else:
+            transcript = await capture_captions_observer(page, deadline)
 
         print("Done capturing transcript")
 
         # Return the transcript instead of saving to a file
         print("Returning the captured transcript")
 
-        # Close the Google Meet window after capturing
-        await browser.close()
-        display.stop()
-        print("Closed the Google Meet window")
-        print("- End of work")
+    # The browser context is closed and the browser returned to the pool on exit
+    print("Closed the Google Meet window")
+    print("- End of work")
 
-        return transcript
+    return transcript
@@ -0,0 +1,268 @@
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from playwright.async_api import async_playwright
+from .resources import host_resources
+
+# Load environment variables
+load_dotenv()
+
+# Maximum number of browsers (each with its own Xvfb display and sinks) alive at once;
+# defaults to the host capacity estimate
+BROWSER_POOL_MAX_SIZE = int(os.getenv("BROWSER_POOL_MAX_SIZE", "0"))
+# Number of idle browsers to keep warm for the next meeting
+BROWSER_POOL_MIN_IDLE = int(os.getenv("BROWSER_POOL_MIN_IDLE", "1"))
+# Recycle a browser after it has served this many meetings
+BROWSER_POOL_MAX_USES = int(os.getenv("BROWSER_POOL_MAX_USES", "20"))
+# Close idle browsers (above BROWSER_POOL_MIN_IDLE) after this many seconds
+BROWSER_POOL_IDLE_TIMEOUT = int(os.getenv("BROWSER_POOL_IDLE_TIMEOUT", "900"))
+# How often the pool runs health checks, eviction and refills
+BROWSER_POOL_MAINTENANCE_INTERVAL = int(os.getenv("BROWSER_POOL_MAINTENANCE_INTERVAL", "30"))
+
+BROWSER_ARGS = [
+    "--disable-blink-features=AutomationControlled",
+    "--use-fake-ui-for-media-stream",
+    "--use-fake-device-for-media-stream",
+    "--window-size=1920x1080",
+    "--no-sandbox",
+    "--disable-setuid-sandbox",
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-application-cache",
+    "--disable-dev-shm-usage"
+]
+
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 " \
+    "(KHTML, like Gecko) Chrome/112.0.0.0 Safari/537.36"
+]
+
+# Stealth-like script added to every context handed out by the pool
+STEALTH_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
+    Object.defineProperty(navigator, 'plugins', { get: () => [1, 2, 3] });
+    Object.defineProperty(navigator, 'languages', { get: () => ['en-US', 'en'] });
+    window.chrome = { runtime: {} };
+    Object.defineProperty(navigator, 'hardwareConcurrency', { get: () => 4 });
+    Object.defineProperty(navigator, 'deviceMemory', { get: () => 8 });
+"""
+
+
+class PooledBrowser:
+    """A Chromium instance running on its own virtual display and audio sinks."""
+
+    def __init__(self, resources, browser):
+        self.resources = resources
+        self.browser = browser
+        self.uses = 0
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.closed = False
+
+    def is_healthy(self):
+        return self.browser.is_connected()
+
+    async def close(self):
+        # A leased browser is closed by the pool's close() and again when released
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self.browser.close()
+        except Exception as e:
+            print(f"Error closing pooled browser: {e}")
+        await asyncio.to_thread(host_resources.release, self.resources)
+
+
+class BrowserPool:
+    """
+    Keeps pre-launched browsers and virtual displays warm for Google Meet bots.
+
+    Each meeting leases one browser and gets a fresh, isolated browser context
+    from it; the context is closed when the meeting ends and the browser goes
+    back to the pool. Browsers are health checked before every lease, recycled
+    after `max_uses` meetings and evicted after `idle_timeout` seconds idle.
+    """
+
+    def __init__(self, max_size=BROWSER_POOL_MAX_SIZE, min_idle=BROWSER_POOL_MIN_IDLE,
+                 max_uses=BROWSER_POOL_MAX_USES, idle_timeout=BROWSER_POOL_IDLE_TIMEOUT):
+        self.max_size = max_size or host_resources.max_bots
+        self.min_idle = min(min_idle, self.max_size)
+        self.max_uses = max_uses
+        self.idle_timeout = idle_timeout
+        self._playwright = None
+        self._idle = []
+        self._leased = set()
+        self._launching = 0
+        # Background close() tasks of unhealthy browsers, awaited by close()
+        self._closing = set()
+        self._cond = None
+        # Serializes start(), so concurrent callers launch one Playwright driver
+        self._start_lock = asyncio.Lock()
+        self._maintenance_task = None
+        self._closed = False
+        self._counters = {"launched": 0, "recycled": 0, "evicted": 0, "unhealthy": 0, "leases": 0}
+
+    async def start(self):
+        async with self._start_lock:
+            if self._playwright is not None:
+                return
+            self._closed = False
+            self._cond = asyncio.Condition()
+            self._playwright = await async_playwright().start()
+            self._maintenance_task = asyncio.create_task(self._maintain())
+            print(f"Browser pool started (max_size={self.max_size}, min_idle={self.min_idle})")
+
+    async def close(self):
+        if self._playwright is None:
+            return
+        self._closed = True
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+            self._maintenance_task = None
+        async with self._cond:
+            instances = self._idle + list(self._leased)
+            self._idle = []
+            self._leased = set()
+        await asyncio.gather(*(instance.close() for instance in instances), *self._closing)
+        await self._playwright.stop()
+        self._playwright = None
+        print("Browser pool closed")
+
+    @asynccontextmanager
+    async def context(self):
+        """Lease a warm browser and yield a fresh browser context for one meeting."""
+        await self.start()
+        instance = await self._lease()
+        context = None
+        try:
+            context = await instance.browser.new_context(
+                user_agent=random.choice(USER_AGENTS),
+                locale="en-US",
+                timezone_id="America/Los_Angeles"
+            )
+            await context.add_init_script(STEALTH_SCRIPT)
+            yield context
+        finally:
+            if context is not None:
+                try:
+                    await context.close()
+                except Exception as e:
+                    print(f"Error closing browser context: {e}")
+            await self._release(instance)
+
+    def stats(self):
+        return {
+            "max_size": self.max_size,
+            "idle": len(self._idle),
+            "leased": len(self._leased),
+            "launching": self._launching,
+            **self._counters
+        }
+
+    async def _launch(self):
+        resources = await asyncio.to_thread(host_resources.allocate)
+        try:
+            browser = await self._playwright.chromium.launch(
+                headless=False,
+                args=BROWSER_ARGS,
+                env=resources.env()
+            )
+        except Exception:
+            await asyncio.to_thread(host_resources.release, resources)
+            raise
+        self._counters["launched"] += 1
+        return PooledBrowser(resources, browser)
+
+    async def _lease(self):
+        async with self._cond:
+            while True:
+                while self._idle:
+                    instance = self._idle.pop()
+                    if instance.is_healthy():
+                        self._leased.add(instance)
+                        self._counters["leases"] += 1
+                        return instance
+                    self._counters["unhealthy"] += 1
+                    task = asyncio.create_task(instance.close())
+                    self._closing.add(task)
+                    task.add_done_callback(self._closing.discard)
+                if len(self._idle) + len(self._leased) + self._launching < self.max_size:
+                    self._launching += 1
+                    break
+                await self._cond.wait()
+
+        instance = None
+        try:
+            instance = await self._launch()
+        finally:
+            async with self._cond:
+                self._launching -= 1
+                if instance is not None:
+                    self._leased.add(instance)
+                    self._counters["leases"] += 1
+                self._cond.notify()
+        return instance
+
+    async def _release(self, instance):
+        instance.uses += 1
+        instance.last_used = time.time()
+        retire = self._closed or instance.uses >= self.max_uses or not instance.is_healthy()
+        async with self._cond:
+            self._leased.discard(instance)
+            if not retire:
+                self._idle.append(instance)
+            self._cond.notify()
+        if retire and not instance.closed:
+            self._counters["recycled"] += 1
+            await instance.close()
+
+    async def _maintain(self):
+        while not self._closed:
+            try:
+                await self._evict_and_refill()
+            except Exception as e:
+                print(f"Browser pool maintenance failed: {e}")
+            await asyncio.sleep(BROWSER_POOL_MAINTENANCE_INTERVAL)
+
+    async def _evict_and_refill(self):
+        now = time.time()
+        to_close = []
+        async with self._cond:
+            keep = []
+            # Oldest-used first, so the most recently used browsers stay warm
+            for instance in sorted(self._idle, key=lambda i: i.last_used):
+                if not instance.is_healthy():
+                    self._counters["unhealthy"] += 1
+                    to_close.append(instance)
+                elif now - instance.last_used > self.idle_timeout and len(self._idle) - len(to_close) > self.min_idle:
+                    self._counters["evicted"] += 1
+                    to_close.append(instance)
+                else:
+                    keep.append(instance)
+            self._idle = keep
+            missing = min(
+                self.min_idle - len(self._idle),
+                self.max_size - len(self._idle) - len(self._leased) - self._launching
+            )
+            missing = max(missing, 0)
+            self._launching += missing
+        await asyncio.gather(*(instance.close() for instance in to_close))
+
+        for _ in range(missing):
+            instance = None
+            try:
+                instance = await self._launch()
+            except Exception as e:
+                print(f"Failed to pre-launch browser: {e}")
+            async with self._cond:
+                self._launching -= 1
+                if instance is not None:
+                    self._idle.append(instance)
+                self._cond.notify()
+
+
+browser_pool = BrowserPool()
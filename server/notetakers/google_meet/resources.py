@@ -0,0 +1,161 @@
+import os
+import subprocess
+import threading
+import uuid
+from dotenv import load_dotenv
+from pyvirtualdisplay import Display
+
+# Load environment variables
+load_dotenv()
+
+# Prefix for every PulseAudio sink created by a bot, used to find leaked modules
+SINK_PREFIX = "notetaker_"
+# Hard cap on concurrent bots on this host; estimated from CPU and memory when unset
+MAX_CONCURRENT_BOTS = int(os.getenv("MAX_CONCURRENT_BOTS", "0"))
+# Rough per-bot cost used for the capacity estimate
+BOTS_PER_CPU = float(os.getenv("BOTS_PER_CPU", "1"))
+BOT_MEMORY_MB = int(os.getenv("BOT_MEMORY_MB", "600"))
+
+
+class BotResources:
+    """The virtual display and PulseAudio sinks owned by a single bot."""
+
+    def __init__(self, name, display, output_sink, mic_sink, module_ids):
+        self.name = name
+        self.display = display
+        self.output_sink = output_sink
+        self.mic_sink = mic_sink
+        self.module_ids = module_ids
+
+    def env(self):
+        """Environment for the bot's browser so it only sees its own display and sinks."""
+        return {
+            **os.environ,
+            "DISPLAY": self.display.new_display_var,
+            "PULSE_SINK": self.output_sink,
+            "PULSE_SOURCE": f"{self.mic_sink}.monitor"
+        }
+
+
+def _pactl(*args):
+    return subprocess.check_output(["pactl", *args], text=True).strip()
+
+
+def _mem_available_mb():
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+class HostResources:
+    """
+    Allocates per-bot displays and uniquely named PulseAudio null sinks, and
+    tracks how many more bots this host can take.
+
+    Every bot gets its own output sink and mic sink (`notetaker_<id>_out` /
+    `notetaker_<id>_mic`) instead of sharing global sinks and the default
+    source, so concurrent bots on one host never fight over PulseAudio state.
+    All calls are blocking and meant to be run from a thread.
+    """
+
+    def __init__(self, max_bots=MAX_CONCURRENT_BOTS):
+        self._max_bots = max_bots
+        self._active = {}
+        self._lock = threading.Lock()
+
+    @property
+    def max_bots(self):
+        return self._max_bots_for(len(self._active))
+
+    def _max_bots_for(self, active):
+        if self._max_bots > 0:
+            return self._max_bots
+        limits = [max(int((os.cpu_count() or 1) * BOTS_PER_CPU), 1)]
+        mem_available = _mem_available_mb()
+        if mem_available is not None:
+            # Memory already used by running bots is not "available" anymore
+            limits.append(mem_available // BOT_MEMORY_MB + active)
+        return max(min(limits), 1)
+
+    def allocate(self):
+        name = f"{SINK_PREFIX}{uuid.uuid4().hex[:8]}"
+        output_sink = f"{name}_out"
+        mic_sink = f"{name}_mic"
+        module_ids = []
+        display = None
+        try:
+            for sink in (output_sink, mic_sink):
+                module_ids.append(_pactl("load-module", "module-null-sink", f"sink_name={sink}",
+                                         f"sink_properties=device.description={sink}"))
+            display = Display(visible=False, size=(1920, 1080), manage_global_env=False)
+            display.start()
+        except Exception as e:
+            print(f"Failed to allocate resources for {name}: {e}")
+            self._unload(module_ids)
+            raise
+
+        resources = BotResources(name, display, output_sink, mic_sink, module_ids)
+        with self._lock:
+            self._active[name] = resources
+        print(f"Allocated display {display.new_display_var} and sinks {output_sink}, {mic_sink}")
+        return resources
+
+    def release(self, resources):
+        with self._lock:
+            self._active.pop(resources.name, None)
+        try:
+            resources.display.stop()
+        except Exception as e:
+            print(f"Error stopping virtual display for {resources.name}: {e}")
+        self._unload(resources.module_ids)
+
+    def cleanup_stale_sinks(self):
+        """Unload sinks left behind by bots that died without releasing them."""
+        with self._lock:
+            active_modules = {module_id for r in self._active.values() for module_id in r.module_ids}
+        try:
+            modules = _pactl("list", "short", "modules").splitlines()
+        except Exception as e:
+            print(f"Could not list PulseAudio modules: {e}")
+            return 0
+        stale = [
+            line.split("\t")[0] for line in modules
+            if f"sink_name={SINK_PREFIX}" in line and line.split("\t")[0] not in active_modules
+        ]
+        self._unload(stale)
+        if stale:
+            print(f"Unloaded {len(stale)} stale PulseAudio modules")
+        return len(stale)
+
+    def capacity(self, active=None):
+        """
+        Free bot slots on this host.
+
+        `active` overrides the count of bots allocated in this process, e.g.
+        from the API process, where bots are allocated in worker processes.
+        """
+        if active is None:
+            active = len(self._active)
+        max_bots = self._max_bots_for(active)
+        return {
+            "max_bots": max_bots,
+            "active_bots": active,
+            "free_slots": max(max_bots - active, 0),
+            "cpu_count": os.cpu_count(),
+            "mem_available_mb": _mem_available_mb()
+        }
+
+    def _unload(self, module_ids):
+        for module_id in module_ids:
+            try:
+                _pactl("unload-module", module_id)
+            except Exception as e:
+                print(f"Failed to unload PulseAudio module {module_id}: {e}")
+
+
+host_resources = HostResources()
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import random
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Which screenshots to take: "off", "key" (milestones only) or "debug" (every step)
+SCREENSHOT_LEVEL = os.getenv("SCREENSHOT_LEVEL", "debug")
+# Fraction of eligible screenshots that are actually taken (0.0 - 1.0)
+SCREENSHOT_SAMPLE_RATE = float(os.getenv("SCREENSHOT_SAMPLE_RATE", "1.0"))
+# Screenshots waiting for upload beyond this are dropped instead of blocking the bot
+SCREENSHOT_QUEUE_SIZE = int(os.getenv("SCREENSHOT_QUEUE_SIZE", "64"))
+SCREENSHOT_UPLOAD_WORKERS = int(os.getenv("SCREENSHOT_UPLOAD_WORKERS", "2"))
+
+LEVELS = {"off": 0, "key": 1, "debug": 2}
+
+
+class ScreenshotUploader:
+    """
+    Bounded background queue for screenshot uploads.
+
+    `submit` never blocks the caller: the PNG bytes are queued as-is and a
+    small set of workers awaits the async upload function for each one.
+    When the queue is full the screenshot is dropped and counted.
+    """
+
+    def __init__(self, upload, level=SCREENSHOT_LEVEL, sample_rate=SCREENSHOT_SAMPLE_RATE,
+                 maxsize=SCREENSHOT_QUEUE_SIZE, workers=SCREENSHOT_UPLOAD_WORKERS):
+        self.upload = upload
+        self.level = LEVELS.get(level, LEVELS["debug"])
+        self.sample_rate = sample_rate
+        self.maxsize = maxsize
+        self.workers = workers
+        self._queue = None
+        self._tasks = []
+        self._counters = {"submitted": 0, "uploaded": 0, "failed": 0, "dropped": 0, "skipped": 0}
+
+    def should_capture(self, level="debug"):
+        """Whether a screenshot at `level` should be taken at all, so callers can skip page.screenshot."""
+        if LEVELS.get(level, LEVELS["debug"]) > self.level or random.random() >= self.sample_rate:
+            self._counters["skipped"] += 1
+            return False
+        return True
+
+    def submit(self, filename, data):
+        self._start()
+        try:
+            self._queue.put_nowait((filename, data))
+        except asyncio.QueueFull:
+            self._counters["dropped"] += 1
+            print(f"Screenshot queue full, dropping {filename}")
+            return False
+        self._counters["submitted"] += 1
+        return True
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_size": self.maxsize,
+            **self._counters
+        }
+
+    async def close(self, timeout=10):
+        """Give queued uploads a chance to finish, then stop the workers."""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Screenshot uploads still pending after {timeout}s, abandoning {self._queue.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._queue = None
+
+    def _start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self):
+        while True:
+            filename, data = await self._queue.get()
+            try:
+                await self.upload(filename, data)
+                self._counters["uploaded"] += 1
+            except Exception as e:
+                self._counters["failed"] += 1
+                print(f"Failed to upload screenshot {filename}: {e}")
+            finally:
+                self._queue.task_done()
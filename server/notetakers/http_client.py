@@ -0,0 +1,62 @@
+import asyncio
+import os
+import aiohttp
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Total connections across all hosts, and per host
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+# How long an idle keep-alive connection is kept open for reuse
+HTTP_KEEPALIVE_SECONDS = int(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+# Default timeouts; callers can pass their own `timeout=` per request
+HTTP_TIMEOUT_SECONDS = int(os.getenv("HTTP_TIMEOUT_SECONDS", "30"))
+HTTP_CONNECT_TIMEOUT_SECONDS = int(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "10"))
+
+
+class HttpClient:
+    """
+    Application-wide aiohttp session with keep-alive connection pooling.
+
+    Every outbound call shares one connector, so Google, Supabase functions,
+    the cron server and Deepgram reuse warm TCP+TLS connections instead of
+    handshaking per request. The session is bound to the event loop that
+    created it; a process with a different loop (e.g. a meeting worker) gets
+    its own session on first use.
+    """
+
+    def __init__(self):
+        self._session = None
+        self._loop = None
+
+    def session(self):
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+                ttl_dns_cache=300
+            )
+            timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self._loop = loop
+        return self._session
+
+    async def start(self):
+        self.session()
+
+    async def close(self):
+        if self._session is not None and not self._session.closed and self._loop is asyncio.get_running_loop():
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+
+http_client = HttpClient()
+
+
+def get_session():
+    """The shared session for the running event loop."""
+    return http_client.session()
@@ -0,0 +1,330 @@
+import asyncio
+import atexit
+import multiprocessing
+import os
+import json
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from dateutil import parser
+from dotenv import load_dotenv
+
+from . import db
+from .google_meet.gmeet import join_meet, screenshot_uploader
+from .google_meet.pool import browser_pool
+from .google_meet.resources import host_resources
+from .zoom.zoom import join_zoom_meeting_async
+from .agent.cleanup import clean_google_meet_transcript
+from .agent.summarizer import summarize_transcript
+
+load_dotenv()
+
+# Number of meeting worker processes; each runs one meeting at a time
+MEETING_WORKERS = int(os.getenv("MEETING_WORKERS", "0")) or host_resources.max_bots
+# Zoom meetings run as asyncio tasks in the API process (the zoomsdk subprocess
+# does the heavy lifting); this caps how many run at once
+ZOOM_MAX_CONCURRENT = int(os.getenv("ZOOM_MAX_CONCURRENT", "50"))
+# Finished jobs kept in memory for the status/result endpoints
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "1000"))
+# How long an exiting worker waits for screenshot uploads and browsers to close
+WORKER_SHUTDOWN_TIMEOUT_SECONDS = int(os.getenv("WORKER_SHUTDOWN_TIMEOUT_SECONDS", "60"))
+
+
+# ---- Worker process side ----
+
+# Each worker process runs one event loop in a background thread for its whole
+# life, so the browser pool and screenshot uploads keep running between meetings.
+_worker_loop = None
+_worker_events = None
+
+
+def _init_worker(events):
+    global _worker_loop, _worker_events
+    _worker_events = events
+    _worker_loop = asyncio.new_event_loop()
+    threading.Thread(target=_worker_loop.run_forever, daemon=True).start()
+    # Workers exit normally once the executor shuts down, which runs atexit hooks
+    atexit.register(_shutdown_worker)
+    # A worker only ever runs one meeting, so it needs at most one warm browser
+    browser_pool.max_size = 1
+    browser_pool.min_idle = min(browser_pool.min_idle, 1)
+    try:
+        asyncio.run_coroutine_threadsafe(browser_pool.start(), _worker_loop).result()
+    except Exception as e:
+        # Not fatal: the first meeting retries through browser_pool.context()
+        print(f"Failed to start the browser pool in worker {os.getpid()}: {e}")
+
+
+def _shutdown_worker():
+    """Flush queued screenshot uploads and close the browsers and their displays."""
+    async def close():
+        await screenshot_uploader.close()
+        await browser_pool.close()
+
+    try:
+        asyncio.run_coroutine_threadsafe(close(), _worker_loop).result(WORKER_SHUTDOWN_TIMEOUT_SECONDS)
+    except Exception as e:
+        print(f"Worker {os.getpid()} shutdown failed: {e}")
+    _worker_loop.call_soon_threadsafe(_worker_loop.stop)
+
+
+def _worker_stats():
+    return {
+        "pid": os.getpid(),
+        "browser_pool": browser_pool.stats(),
+        "screenshots": screenshot_uploader.stats(),
+        "db": db.database.stats()
+    }
+
+
+def meeting_minutes(payload):
+    """
+    Minutes a bot stays in the meeting.
+
+    Scheduled joins fire ahead of the event's start (see the cron server's
+    lead time), so when the event's end is known the bot stays until then
+    instead of for the event's length from the moment it joined.
+    """
+    event_end = (payload.get("event_data") or {}).get("end_time")
+    if event_end:
+        remaining = (parser.isoparse(event_end) - datetime.now(timezone.utc)).total_seconds()
+        return max(1, math.ceil(remaining / 60))
+    return payload["end_time"]
+
+
+async def run_meet_pipeline(payload):
+    start_time = datetime.now()
+    transcript = await join_meet(payload["meet_link"], meeting_minutes(payload))
+
+    # Calculate duration
+    end_time = datetime.now()
+
+    if not transcript:
+        return {"summary": "Agent was never accepted into the call", "cleaned_transcript": []}
+
+    cleaned_transcript = await asyncio.to_thread(clean_google_meet_transcript, transcript)
+
+    cleaned_transcript_text = '\n'.join([f"{entry['user']} at {entry['time']}: {entry['content']}" for entry in cleaned_transcript])
+
+    summary = await asyncio.to_thread(summarize_transcript, cleaned_transcript_text)
+
+    # Add to Supabase
+    data = {
+        "user_id": payload["user_id"],
+        "meeting_link": payload["meet_link"],
+        "summary": json.dumps(summary),
+        "transcript": json.dumps(cleaned_transcript),
+        "start_time": start_time.isoformat(),
+        "end_time": end_time.isoformat(),
+        "attendees": json.dumps(list(set([entry['user'] for entry in cleaned_transcript]))),
+        "type":"gmeet"
+    }
+    response = await db.insert_meeting(data)
+    print(response)
+
+    return {"summary": summary, "cleaned_transcript": cleaned_transcript}
+
+
+async def run_zoom_pipeline(payload):
+    meeting_link = payload["meet_link"]
+    end_time = payload["end_time"]
+    event_data = payload.get("event_data") or {}
+
+    transcript = await join_zoom_meeting_async(meeting_link, meeting_minutes(payload))
+
+    summary = await asyncio.to_thread(summarize_transcript, transcript)
+
+    data = {
+        "user_id": payload.get("user_id"),
+        "meeting_link": meeting_link,
+        "summary": json.dumps(summary),
+        "transcript": json.dumps(transcript),
+        "start_time": parser.isoparse(event_data.get('start_time')).isoformat(),
+        "end_time": (parser.isoparse(event_data.get('start_time')) + timedelta(minutes=int(end_time))).isoformat(),
+        "attendees": event_data.get('attendees'),
+        "type":"zoom"
+    }
+
+    response = await db.insert_meeting(data)
+    print(response)
+
+    return {"summary": summary, "transcript": transcript}
+
+
+PIPELINES = {
+    "meet": run_meet_pipeline,
+    "zoom": run_zoom_pipeline,
+}
+
+# Job kinds that run on the API process event loop instead of a worker process
+IN_PROCESS_KINDS = {"zoom"}
+
+
+def _run_job(job_id, kind, payload):
+    """Entry point executed inside a worker process. Never raises, so results always pickle."""
+    _worker_events.put((job_id, "running", time.time()))
+    try:
+        result = asyncio.run_coroutine_threadsafe(PIPELINES[kind](payload), _worker_loop).result()
+        return {"status": "succeeded", "result": result, "worker": _worker_stats()}
+    except Exception as e:
+        detail = getattr(e, "detail", None) or str(e) or type(e).__name__
+        print(f"Job {job_id} failed: {detail}")
+        return {"status": "failed", "error": detail, "worker": _worker_stats()}
+
+
+# ---- API process side ----
+
+class JobManager:
+    """
+    Runs meeting jobs in the background and tracks their status.
+
+    `submit` returns a job id immediately. Google Meet jobs (a browser driven
+    from Python) run in a pool of worker processes; Zoom jobs only supervise
+    the zoomsdk subprocess, so they run as tasks on the API event loop, up to
+    ZOOM_MAX_CONCURRENT at a time.
+    Job records live in memory in the API process, which is enough because
+    every meeting result is also persisted to the `meetings` table.
+    """
+
+    def __init__(self, max_workers=MEETING_WORKERS, retention=JOB_RETENTION):
+        self.max_workers = max_workers
+        self.retention = retention
+        self._jobs = OrderedDict()
+        self._worker_stats = {}
+        self._executor = None
+        self._events = None
+        self._event_thread = None
+        self._local_slots = None
+        self._local_tasks = {}
+
+    def start(self):
+        if self._executor is not None:
+            return
+        # Only safe before any worker exists: a worker only knows its own sinks,
+        # so cleaning up from a worker would unload the sinks of running meetings
+        host_resources.cleanup_stale_sinks()
+        ctx = multiprocessing.get_context("spawn")
+        self._events = ctx.Queue()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(self._events,)
+        )
+        self._event_thread = threading.Thread(target=self._read_events, daemon=True)
+        self._event_thread.start()
+        print(f"Job manager started with {self.max_workers} meeting workers")
+
+    async def shutdown(self):
+        if self._executor is None:
+            return
+        tasks = list(self._local_tasks.values())
+        for task in tasks:
+            task.cancel()
+        # Cancelled Zoom jobs still have to stop their zoomsdk processes
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Each worker closes its browsers and flushes its screenshots as it
+        # exits (see _shutdown_worker): idle ones right away, busy ones once
+        # their meeting ends
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._events.put(None)
+        self._executor = None
+
+    def submit(self, kind, payload):
+        self.start()
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "kind": kind,
+            "status": "queued",
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "result": None
+        }
+        self._jobs[job_id] = job
+        self._prune()
+
+        if kind in IN_PROCESS_KINDS:
+            task = asyncio.create_task(self._run_local(job_id, kind, payload))
+            self._local_tasks[job_id] = task
+            task.add_done_callback(lambda _: self._local_tasks.pop(job_id, None))
+        else:
+            future = self._executor.submit(_run_job, job_id, kind, payload)
+            future.add_done_callback(lambda f: self._finish(job_id, f))
+        return job_id
+
+    async def _run_local(self, job_id, kind, payload):
+        if self._local_slots is None:
+            self._local_slots = asyncio.Semaphore(ZOOM_MAX_CONCURRENT)
+        job = self._jobs[job_id]
+        async with self._local_slots:
+            job["status"] = "running"
+            job["started_at"] = time.time()
+            try:
+                job["result"] = await PIPELINES[kind](payload)
+                job["status"] = "succeeded"
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                job["status"] = "failed"
+                job["error"] = str(e) or type(e).__name__
+            finally:
+                job["finished_at"] = time.time()
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def stats(self):
+        counts = {"queued": 0, "running": 0, "succeeded": 0, "failed": 0}
+        for job in self._jobs.values():
+            counts[job["status"]] += 1
+        return {"workers": self.max_workers, **counts, "worker_stats": list(self._worker_stats.values())}
+
+    def active(self):
+        """Queued or running jobs that need a browser slot on this host; Zoom jobs don't."""
+        return sum(
+            1 for job in self._jobs.values()
+            if job["status"] in ("queued", "running") and job["kind"] not in IN_PROCESS_KINDS
+        )
+
+    def _finish(self, job_id, future):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        job["finished_at"] = time.time()
+        try:
+            outcome = future.result()
+        except Exception as e:
+            # The worker process itself died or the job was cancelled
+            outcome = {"status": "failed", "error": str(e) or type(e).__name__}
+        job["status"] = outcome["status"]
+        job["result"] = outcome.get("result")
+        job["error"] = outcome.get("error")
+        # Browser pool and screenshot stats live in the workers; keep the latest per process
+        if outcome.get("worker"):
+            self._worker_stats[outcome["worker"]["pid"]] = outcome["worker"]
+
+    def _read_events(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            job_id, status, timestamp = event
+            job = self._jobs.get(job_id)
+            if job is not None and job["status"] == "queued":
+                job["status"] = status
+                job["started_at"] = timestamp
+
+    def _prune(self):
+        # Drop the oldest finished jobs beyond the retention limit
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in ("succeeded", "failed")]
+        for job_id in finished[:max(len(finished) - self.retention, 0)]:
+            del self._jobs[job_id]
+
+
+job_manager = JobManager()
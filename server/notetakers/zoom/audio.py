@@ -0,0 +1,143 @@
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import soundfile as sf
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# The zoomsdk writes 16-bit mono PCM at 32kHz
+SOURCE_RATE = 32000
+# Speech transcription does not need more than 16kHz
+TARGET_RATE = int(os.getenv("TRANSCRIPTION_SAMPLE_RATE", "16000"))
+# Codec used for the transcription upload: "flac", "opus" or "raw" (no compression stage)
+TRANSCRIPTION_CODEC = os.getenv("TRANSCRIPTION_CODEC", "flac")
+# Process 10 seconds of audio at a time so memory use doesn't grow with meeting length
+CHUNK_SECONDS = 10
+FILTER_TAPS = 63
+
+# codec -> (soundfile format, subtype, content type, file extension)
+CODECS = {
+    "flac": ("FLAC", "PCM_16", "audio/flac", ".flac"),
+    "opus": ("OGG", "OPUS", "audio/ogg", ".ogg"),
+}
+
+
+def lowpass_taps(factor, num_taps=FILTER_TAPS):
+    """Windowed-sinc low-pass filter with its cutoff just below the post-decimation Nyquist."""
+    cutoff = 0.45 / factor
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(num_taps)
+    return (taps / taps.sum()).astype(np.float32)
+
+
+class Decimator:
+    """
+    Integer-factor resampler that can be fed arbitrary-sized chunks.
+
+    Keeps the filter history and the decimation phase between calls, so
+    resampling a file chunk by chunk gives the same output as doing it in one go.
+    """
+
+    def __init__(self, factor):
+        self.factor = factor
+        self.taps = lowpass_taps(factor)
+        self.history = np.zeros(len(self.taps) - 1, dtype=np.float32)
+        self.phase = 0
+
+    def process(self, samples):
+        x = np.concatenate([self.history, samples.astype(np.float32)])
+        filtered = np.convolve(x, self.taps, mode="valid")
+        self.history = x[len(x) - len(self.history):]
+        out = filtered[self.phase::self.factor]
+        self.phase = (self.phase - len(samples)) % self.factor
+        return out
+
+
+def iter_pcm_chunks(path, chunk_samples=SOURCE_RATE * CHUNK_SECONDS, start_sample=0, end_sample=None):
+    """Yield int16 sample arrays from a raw PCM file (optionally a sample range) without loading it whole."""
+    with open(path, 'rb') as audio:
+        audio.seek(start_sample * 2)
+        position = start_sample
+        while end_sample is None or position < end_sample:
+            count = chunk_samples if end_sample is None else min(chunk_samples, end_sample - position)
+            chunk = np.fromfile(audio, dtype='<i2', count=count)
+            if not len(chunk):
+                return
+            position += len(chunk)
+            yield chunk
+
+
+def encode_pcm_file(src_path, dst_path=None, codec=TRANSCRIPTION_CODEC,
+                    source_rate=SOURCE_RATE, target_rate=TARGET_RATE, start_sample=0, end_sample=None):
+    """
+    Resample a raw 16-bit mono PCM file (or the given sample range of it) and encode it for upload.
+
+    Returns (dst_path, content_type, stats) where stats has the input/output
+    sizes and the CPU time spent.
+    """
+    if source_rate % target_rate:
+        raise ValueError(f"Can only resample by an integer factor, got {source_rate} -> {target_rate}")
+    fmt, subtype, content_type, extension = CODECS[codec]
+    if dst_path is None:
+        fd, dst_path = tempfile.mkstemp(suffix=extension, dir=os.path.dirname(src_path) or None)
+        os.close(fd)
+
+    cpu_start = time.process_time()
+    decimator = Decimator(source_rate // target_rate) if source_rate != target_rate else None
+    samples = 0
+    with sf.SoundFile(dst_path, 'w', samplerate=target_rate, channels=1, format=fmt, subtype=subtype) as out:
+        for chunk in iter_pcm_chunks(src_path, start_sample=start_sample, end_sample=end_sample):
+            samples += len(chunk)
+            if decimator is not None:
+                chunk = np.clip(np.rint(decimator.process(chunk)), -32768, 32767).astype(np.int16)
+            out.write(chunk)
+
+    stats = {
+        "codec": codec,
+        "audio_seconds": samples / source_rate,
+        "input_bytes": samples * 2,
+        "output_bytes": os.path.getsize(dst_path),
+        "cpu_seconds": time.process_time() - cpu_start
+    }
+    return dst_path, content_type, stats
+
+
+def _synthetic_meeting(path, seconds, rate=SOURCE_RATE):
+    # Alternating "talk" (modulated harmonics plus noise) and near-silent stretches
+    rng = np.random.default_rng(0)
+    with open(path, 'wb') as audio:
+        for start in range(0, seconds, CHUNK_SECONDS):
+            t = np.arange(rate * CHUNK_SECONDS) / rate + start
+            talking = (start // CHUNK_SECONDS) % 3 != 2
+            signal = rng.normal(0, 30, len(t))
+            if talking:
+                envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+                signal += envelope * sum(3000 / k * np.sin(2 * np.pi * 180 * k * t) for k in range(1, 8))
+            np.clip(signal, -32768, 32767).astype('<i2').tofile(audio)
+
+
+def benchmark(seconds=600):
+    """Compare bytes on the wire and CPU cost of each upload codec on a synthetic meeting."""
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "meeting.pcm")
+        _synthetic_meeting(src, seconds)
+        raw_bytes = os.path.getsize(src)
+        print(f"{'codec':<8}{'bytes':>14}{'ratio':>8}{'MB/hour':>10}{'cpu s':>8}{'x realtime':>12}")
+        print(f"{'raw':<8}{raw_bytes:>14}{1:>8.1f}{raw_bytes / seconds * 3600 / 1e6:>10.1f}{0:>8.2f}{'-':>12}")
+        for codec in CODECS:
+            _, _, stats = encode_pcm_file(src, codec=codec)
+            print(
+                f"{codec:<8}{stats['output_bytes']:>14}{raw_bytes / stats['output_bytes']:>8.1f}"
+                f"{stats['output_bytes'] / seconds * 3600 / 1e6:>10.1f}{stats['cpu_seconds']:>8.2f}"
+                f"{stats['audio_seconds'] / max(stats['cpu_seconds'], 1e-9):>12.0f}"
+            )
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the transcription upload codecs")
+    arg_parser.add_argument("--seconds", type=int, default=600, help="length of the synthetic meeting")
+    benchmark(arg_parser.parse_args().seconds)
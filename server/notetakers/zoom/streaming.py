@@ -0,0 +1,139 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from urllib.parse import urlencode
+from dotenv import load_dotenv
+from .transcript import words_to_response
+
+try:
+    # websockets >= 13 ships the new asyncio client
+    from websockets.asyncio.client import connect as ws_connect
+    HEADERS_KWARG = "additional_headers"
+except ImportError:
+    from websockets import connect as ws_connect
+    HEADERS_KWARG = "extra_headers"
+
+# Load environment variables
+load_dotenv()
+
+deepgram_api_key = os.getenv('DEEPGRAM')
+
+# Live transcription endpoint; point it at a local websocket server to test
+DEEPGRAM_STREAM_URL = os.getenv("DEEPGRAM_STREAM_URL", "wss://api.deepgram.com/v1/listen")
+# The zoomsdk writes 16-bit mono PCM at 32kHz
+SAMPLE_RATE = 32000
+BYTES_PER_SAMPLE = 2
+# Send audio in 250ms chunks
+STREAM_CHUNK_BYTES = int(os.getenv("STREAM_CHUNK_BYTES", str(SAMPLE_RATE * BYTES_PER_SAMPLE // 4)))
+# How often to check the recording for new audio
+TAIL_POLL_SECONDS = 0.2
+# Deepgram closes idle streams after ~10s without audio
+KEEPALIVE_SECONDS = 5
+# How long to wait for the final results after the stream is closed
+FINALIZE_TIMEOUT_SECONDS = 30
+
+
+async def tail_pcm(path, stop_event, chunk_size=STREAM_CHUNK_BYTES, poll_interval=TAIL_POLL_SECONDS):
+    """
+    Yield fixed-size chunks of a PCM file while it is still being written.
+
+    Waits for the file to appear, then follows it like `tail -f`. Once
+    `stop_event` is set, whatever is left (including a final partial chunk,
+    trimmed to whole samples) is yielded and the generator ends.
+    """
+    while not os.path.exists(path):
+        if stop_event.is_set():
+            return
+        await asyncio.sleep(poll_interval)
+
+    with open(path, 'rb') as audio:
+        buffer = b""
+        while True:
+            data = audio.read(chunk_size - len(buffer))
+            if data:
+                buffer += data
+                if len(buffer) == chunk_size:
+                    yield buffer
+                    buffer = b""
+                continue
+            if stop_event.is_set():
+                # One last read in case the writer flushed right before stopping
+                buffer += audio.read()
+                while len(buffer) >= chunk_size:
+                    yield buffer[:chunk_size]
+                    buffer = buffer[chunk_size:]
+                buffer = buffer[:len(buffer) - len(buffer) % BYTES_PER_SAMPLE]
+                if buffer:
+                    yield buffer
+                return
+            await asyncio.sleep(poll_interval)
+
+
+class StreamingTranscriber:
+    """
+    Streams a growing PCM recording to a live transcription websocket.
+
+    Final results are accumulated as they arrive, so once the meeting ends the
+    transcript is ready as soon as the last chunk has been processed, and a
+    dropped connection only loses what was still in flight.
+    """
+
+    def __init__(self, url=DEEPGRAM_STREAM_URL, api_key=deepgram_api_key, sample_rate=SAMPLE_RATE):
+        self.url = url
+        self.api_key = api_key
+        self.sample_rate = sample_rate
+        self.words = []
+        self.bytes_sent = 0
+        self._last_sent = 0
+
+    def connect(self):
+        params = {
+            "encoding": "linear16",
+            "sample_rate": self.sample_rate,
+            "channels": 1,
+            "diarize": "true",
+            "punctuate": "true"
+        }
+        headers = {"Authorization": f"Token {self.api_key}"}
+        return ws_connect(f"{self.url}?{urlencode(params)}", **{HEADERS_KWARG: headers})
+
+    async def run(self, path, stop_event):
+        """Stream `path` until `stop_event` is set and the file is drained; returns a Deepgram-shaped response."""
+        async with self.connect() as ws:
+            receiver = asyncio.create_task(self._receive(ws))
+            keepalive = asyncio.create_task(self._keepalive(ws))
+            try:
+                async for chunk in tail_pcm(path, stop_event):
+                    await ws.send(chunk)
+                    self.bytes_sent += len(chunk)
+                    self._last_sent = time.time()
+                keepalive.cancel()
+                await ws.send(json.dumps({"type": "CloseStream"}))
+                await asyncio.wait_for(receiver, FINALIZE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                logging.warning("Timed out waiting for final streaming results")
+            finally:
+                keepalive.cancel()
+                receiver.cancel()
+        logging.info(f"Streamed {self.bytes_sent} bytes, received {len(self.words)} words")
+        return words_to_response(self.words)
+
+    async def _receive(self, ws):
+        async for message in ws:
+            try:
+                data = json.loads(message)
+            except (TypeError, ValueError):
+                continue
+            if data.get("type") != "Results" or not data.get("is_final"):
+                continue
+            alternatives = data.get("channel", {}).get("alternatives", [])
+            if alternatives:
+                self.words.extend(alternatives[0].get("words", []))
+
+    async def _keepalive(self, ws):
+        while True:
+            await asyncio.sleep(KEEPALIVE_SECONDS)
+            if time.time() - self._last_sent >= KEEPALIVE_SECONDS:
+                await ws.send(json.dumps({"type": "KeepAlive"}))
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import random
+from collections import Counter
+import aiohttp
+from dotenv import load_dotenv
+from .audio import SOURCE_RATE, TRANSCRIPTION_CODEC, encode_pcm_file
+from .transcript import words_to_response
+from ..http_client import get_session
+
+# Load environment variables
+load_dotenv()
+
+deepgram_api_key = os.getenv('DEEPGRAM')
+
+DEEPGRAM_URL = os.getenv("DEEPGRAM_URL", "https://api.deepgram.com/v1/listen")
+# Length of each uploaded chunk and how much neighbouring chunks overlap
+TRANSCRIBE_CHUNK_SECONDS = int(os.getenv("TRANSCRIBE_CHUNK_SECONDS", "300"))
+# The overlap is also where speakers are matched across chunks, so it should
+# hold a few sentences
+TRANSCRIBE_OVERLAP_SECONDS = int(os.getenv("TRANSCRIBE_OVERLAP_SECONDS", "15"))
+# Words transcribed in both chunks of an overlap start within this many seconds
+SPEAKER_MATCH_TOLERANCE_SECONDS = 0.5
+# Chunks uploaded at the same time for one recording
+TRANSCRIBE_MAX_CONCURRENCY = int(os.getenv("TRANSCRIBE_MAX_CONCURRENCY", "4"))
+# Attempts per chunk, with exponential backoff between them
+TRANSCRIBE_MAX_ATTEMPTS = int(os.getenv("TRANSCRIBE_MAX_ATTEMPTS", "5"))
+TRANSCRIBE_BACKOFF_SECONDS = float(os.getenv("TRANSCRIBE_BACKOFF_SECONDS", "1"))
+TRANSCRIBE_BACKOFF_MAX_SECONDS = float(os.getenv("TRANSCRIBE_BACKOFF_MAX_SECONDS", "30"))
+TRANSCRIBE_TIMEOUT_SECONDS = int(os.getenv("TRANSCRIBE_TIMEOUT_SECONDS", "300"))
+
+# Worth retrying: rate limiting and server-side errors
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class TranscriptionError(Exception):
+    """A chunk could not be transcribed after all retries; the recording must be kept."""
+
+
+def plan_chunks(total_samples, sample_rate=SOURCE_RATE, chunk_seconds=TRANSCRIBE_CHUNK_SECONDS,
+                overlap_seconds=TRANSCRIBE_OVERLAP_SECONDS):
+    """
+    Split a recording into overlapping (start_sample, end_sample) chunks.
+
+    Chunk i starts at i * chunk_seconds and runs `overlap_seconds` into the
+    next one. A tail shorter than the overlap is folded into the last chunk.
+    """
+    step = chunk_seconds * sample_rate
+    overlap = overlap_seconds * sample_rate
+    chunks = []
+    start = 0
+    while start < total_samples:
+        end = min(start + step + overlap, total_samples)
+        if total_samples - end < overlap:
+            end = total_samples
+        chunks.append((start, end))
+        if end == total_samples:
+            break
+        start += step
+    return chunks
+
+
+def match_speakers(previous, current, overlap_from, overlap_to, tolerance=SPEAKER_MATCH_TOLERANCE_SECONDS):
+    """
+    Map a chunk's speaker ids onto the ids already used for the previous chunk.
+
+    `previous` and `current` are the two chunks' words on the recording's
+    timeline, `previous` already relabelled. Words both chunks transcribed
+    in the overlap (same text, starting within `tolerance`) vote for pairing
+    their speakers; pairs are taken by most votes, one-to-one. A speaker with
+    no match keeps its own id if that is still free, otherwise it gets the
+    lowest free one.
+    """
+    earlier = [w for w in previous if overlap_from <= w["start"] < overlap_to]
+    votes = Counter()
+    for word in current:
+        if not overlap_from <= word["start"] < overlap_to:
+            continue
+        text = word["word"].lower()
+        for other in earlier:
+            if other["word"].lower() == text and abs(other["start"] - word["start"]) <= tolerance:
+                votes[word.get("speaker", 0), other.get("speaker", 0)] += 1
+                break
+
+    mapping = {}
+    for (speaker, known), _ in votes.most_common():
+        if speaker not in mapping and known not in mapping.values():
+            mapping[speaker] = known
+    taken = set(mapping.values())
+    for speaker in sorted({word.get("speaker", 0) for word in current} - set(mapping)):
+        label = speaker
+        if label in taken:
+            label = next(i for i in range(len(taken) + 1) if i not in taken)
+        mapping[speaker] = label
+        taken.add(label)
+    return mapping
+
+
+def stitch_words(chunk_words, chunks, sample_rate=SOURCE_RATE):
+    """
+    Merge per-chunk word lists into one timeline.
+
+    Word times are shifted by their chunk's offset. In each overlap, words
+    starting before the middle of the overlap come from the earlier chunk and
+    the rest from the later one, so nothing is duplicated or dropped at cuts.
+    Diarization numbers speakers per chunk, so each chunk's speakers are
+    relabelled to match the previous chunk's by the words they share in the
+    overlap (see match_speakers).
+    """
+    words = []
+    previous = []
+    for i, ((start, end), chunk) in enumerate(zip(chunks, chunk_words)):
+        offset = start / sample_rate
+        keep_from = (start + chunks[i - 1][1]) / 2 / sample_rate if i > 0 else float("-inf")
+        keep_to = (chunks[i + 1][0] + end) / 2 / sample_rate if i + 1 < len(chunks) else float("inf")
+        shifted = [{**word, "start": word["start"] + offset, "end": word["end"] + offset} for word in chunk]
+        if i > 0:
+            mapping = match_speakers(previous, shifted, offset, chunks[i - 1][1] / sample_rate)
+            shifted = [{**word, "speaker": mapping[word.get("speaker", 0)]} for word in shifted]
+        words.extend(word for word in shifted if keep_from <= word["start"] < keep_to)
+        previous = shifted
+    return words
+
+
+async def _post_chunk(path, content_type, params):
+    headers = {
+        'Authorization': f'Token {deepgram_api_key}',
+        'Content-Type': content_type
+    }
+    timeout = aiohttp.ClientTimeout(total=TRANSCRIBE_TIMEOUT_SECONDS)
+    with open(path, 'rb') as audio:
+        async with get_session().post(DEEPGRAM_URL, headers=headers, params=params, data=audio, timeout=timeout) as response:
+            if response.status != 200:
+                detail = await response.text()
+                error = TranscriptionError(f"Deepgram returned {response.status}: {detail[:200]}")
+                error.retryable = response.status in RETRYABLE_STATUSES
+                raise error
+            return await response.json()
+
+
+async def _transcribe_chunk(pcm_path, index, start, end, codec):
+    """Encode one chunk and upload it, retrying transient failures with exponential backoff."""
+    upload_path = None
+    try:
+        if codec == "raw":
+            upload_path = f"{pcm_path}.chunk{index}"
+            with open(pcm_path, 'rb') as src, open(upload_path, 'wb') as dst:
+                src.seek(start * 2)
+                remaining = (end - start) * 2
+                while remaining > 0:
+                    block = src.read(min(remaining, 1 << 20))
+                    if not block:
+                        break
+                    dst.write(block)
+                    remaining -= len(block)
+            content_type = 'audio/raw'
+            params = {"encoding": "linear16", "channels": 1, "sample_rate": SOURCE_RATE,
+                      "paragraphs": "true", "diarize": "true"}
+        else:
+            upload_path, content_type, _ = await asyncio.to_thread(
+                encode_pcm_file, pcm_path, None, codec, start_sample=start, end_sample=end)
+            params = {"paragraphs": "true", "diarize": "true"}
+
+        for attempt in range(1, TRANSCRIBE_MAX_ATTEMPTS + 1):
+            try:
+                response = await _post_chunk(upload_path, content_type, params)
+                return response["results"]["channels"][0]["alternatives"][0].get("words", [])
+            except (aiohttp.ClientError, asyncio.TimeoutError, TranscriptionError) as e:
+                if not getattr(e, "retryable", True) or attempt == TRANSCRIBE_MAX_ATTEMPTS:
+                    raise TranscriptionError(f"Chunk {index} failed after {attempt} attempts: {e}") from e
+                delay = min(TRANSCRIBE_BACKOFF_SECONDS * 2 ** (attempt - 1), TRANSCRIBE_BACKOFF_MAX_SECONDS)
+                delay *= random.uniform(0.5, 1.0)
+                logging.warning(f"Chunk {index} attempt {attempt} failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    finally:
+        if upload_path and os.path.exists(upload_path):
+            os.remove(upload_path)
+
+
+async def transcribe_chunked(pcm_path, codec=TRANSCRIPTION_CODEC, max_concurrency=TRANSCRIBE_MAX_CONCURRENCY):
+    """
+    Transcribe a raw PCM recording as overlapping chunks uploaded in parallel.
+
+    Returns a Deepgram-shaped response for the whole recording. Raises
+    TranscriptionError if any chunk still fails after its retries; the caller
+    must then keep the recording.
+    """
+    chunks = plan_chunks(os.path.getsize(pcm_path) // 2)
+    if not chunks:
+        return words_to_response([])
+    logging.info(f"Transcribing {pcm_path} as {len(chunks)} chunks")
+
+    slots = asyncio.Semaphore(max_concurrency)
+
+    async def run(index, start, end):
+        async with slots:
+            try:
+                return await _transcribe_chunk(pcm_path, index, start, end, codec)
+            except TranscriptionError:
+                raise
+            except Exception as e:
+                raise TranscriptionError(f"Chunk {index} failed: {e}") from e
+
+    tasks = [asyncio.create_task(run(i, start, end)) for i, (start, end) in enumerate(chunks)]
+    try:
+        chunk_words = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    return words_to_response(stitch_words(chunk_words, chunks))
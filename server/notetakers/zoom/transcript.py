@@ -0,0 +1,52 @@
+SENTENCE_ENDINGS = (".", "?", "!")
+
+
+def words_to_response(words):
+    """
+    Build a Deepgram pre-recorded style response from a flat list of words.
+
+    Streaming and chunked transcription both end up with a list of Deepgram
+    word dicts (`word`, `start`, `end`, `speaker`, `punctuated_word`); this
+    groups them into speaker paragraphs and sentences so the stored transcript
+    has the same shape as a single /v1/listen response with paragraphs=true.
+    """
+    words = sorted(words, key=lambda w: w["start"])
+    paragraphs = []
+    for word in words:
+        text = word.get("punctuated_word") or word["word"]
+        speaker = word.get("speaker", 0)
+        if not paragraphs or paragraphs[-1]["speaker"] != speaker:
+            paragraphs.append({"speaker": speaker, "start": word["start"], "end": word["end"], "num_words": 0, "sentences": []})
+        paragraph = paragraphs[-1]
+        sentences = paragraph["sentences"]
+        if not sentences or sentences[-1]["text"].endswith(SENTENCE_ENDINGS):
+            sentences.append({"text": text, "start": word["start"], "end": word["end"]})
+        else:
+            sentences[-1]["text"] += " " + text
+            sentences[-1]["end"] = word["end"]
+        paragraph["end"] = word["end"]
+        paragraph["num_words"] += 1
+
+    transcript = " ".join(word.get("punctuated_word") or word["word"] for word in words)
+    paragraphs_transcript = "\n\n".join(
+        f"Speaker {p['speaker']}: " + " ".join(s["text"] for s in p["sentences"]) for p in paragraphs
+    )
+    return {
+        "results": {
+            "channels": [{
+                "alternatives": [{
+                    "transcript": transcript,
+                    "words": words,
+                    "paragraphs": {"transcript": paragraphs_transcript, "paragraphs": paragraphs}
+                }]
+            }]
+        }
+    }
+
+
+def response_words(response):
+    """The flat word list of a Deepgram response (empty if there is none)."""
+    try:
+        return response["results"]["channels"][0]["alternatives"][0].get("words", [])
+    except (KeyError, IndexError, TypeError):
+        return []
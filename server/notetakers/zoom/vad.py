@@ -0,0 +1,182 @@
+import argparse
+import bisect
+import os
+import tempfile
+import time
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# The zoomsdk writes 16-bit mono PCM at 32kHz
+SAMPLE_RATE = 32000
+FRAME_MS = 20
+# Frames quieter than this are silence (full scale = 0 dBFS)
+SILENCE_THRESHOLD_DBFS = float(os.getenv("SILENCE_THRESHOLD_DBFS", "-45"))
+# Only silences at least this long are dropped; shorter pauses are kept as-is
+MIN_SILENCE_SECONDS = float(os.getenv("MIN_SILENCE_SECONDS", "2.0"))
+# Audio kept on each side of speech so word onsets and tails aren't clipped
+PADDING_SECONDS = float(os.getenv("SILENCE_PADDING_SECONDS", "0.3"))
+# Audio is analysed and copied this many seconds at a time
+BLOCK_SECONDS = 60
+
+
+class OffsetMap:
+    """
+    Maps times in the trimmed audio back to times in the original recording.
+
+    Stored as the start of each kept span in both timelines; a trimmed time
+    falls in the span with the last trimmed start <= t.
+    """
+
+    def __init__(self, trimmed_starts=None, original_starts=None):
+        self.trimmed_starts = trimmed_starts or []
+        self.original_starts = original_starts or []
+
+    def to_original(self, t):
+        i = bisect.bisect_right(self.trimmed_starts, t) - 1
+        if i < 0:
+            return t
+        return self.original_starts[i] + (t - self.trimmed_starts[i])
+
+    def to_list(self):
+        return list(zip(self.trimmed_starts, self.original_starts))
+
+
+def frame_dbfs(samples, frame_len):
+    """RMS level of each whole frame in dBFS, computed for all frames at once."""
+    frames = samples[:len(samples) - len(samples) % frame_len].reshape(-1, frame_len).astype(np.float32)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1.0) / 32768.0)
+
+
+def _runs(mask):
+    """(start, end) index pairs of every run of True in a boolean array."""
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def detect_speech_spans(audio, sample_rate=SAMPLE_RATE, threshold_dbfs=SILENCE_THRESHOLD_DBFS,
+                        min_silence=MIN_SILENCE_SECONDS, padding=PADDING_SECONDS):
+    """
+    Find the sample ranges to keep in an int16 array (typically a np.memmap).
+
+    Levels are computed block by block, so only one frame level per 20ms is
+    held in memory however long the recording is.
+    """
+    frame_len = sample_rate * FRAME_MS // 1000
+    block = frame_len * (sample_rate * BLOCK_SECONDS // frame_len)
+    levels = np.concatenate(
+        [frame_dbfs(audio[start:start + block], frame_len) for start in range(0, len(audio), block)]
+        or [np.zeros(0, dtype=np.float32)]
+    )
+    voiced = levels > threshold_dbfs
+    if not voiced.any():
+        return []
+
+    # Pad speech on both sides
+    pad = int(padding * 1000 / FRAME_MS)
+    if pad:
+        voiced = np.convolve(voiced, np.ones(2 * pad + 1, dtype=np.int8), mode="same") > 0
+
+    # Keep short pauses: fill silent runs shorter than min_silence
+    starts, ends = _runs(~voiced)
+    short = (ends - starts) < int(min_silence * 1000 / FRAME_MS)
+    fill = np.zeros(len(voiced) + 1, dtype=np.int32)
+    fill[starts[short]] += 1
+    fill[ends[short]] -= 1
+    voiced |= np.cumsum(fill[:-1]) > 0
+
+    starts, ends = _runs(voiced)
+    spans = [(int(s) * frame_len, min(int(e) * frame_len, len(audio))) for s, e in zip(starts, ends)]
+    # The trailing partial frame belongs to the last span if that span reaches the end
+    if spans and ends[-1] == len(voiced):
+        spans[-1] = (spans[-1][0], len(audio))
+    return spans
+
+
+def trim_silence(src_path, dst_path, sample_rate=SAMPLE_RATE, **kwargs):
+    """
+    Write only the non-silent parts of a raw PCM file to `dst_path`.
+
+    Returns (offset_map, stats). The source is memory mapped and copied in
+    bounded blocks, so memory use stays flat for hour-long recordings.
+    """
+    start_time = time.perf_counter()
+    audio = np.memmap(src_path, dtype='<i2', mode='r') if os.path.getsize(src_path) >= 2 else np.zeros(0, dtype='<i2')
+    spans = detect_speech_spans(audio, sample_rate, **kwargs)
+
+    offset_map = OffsetMap()
+    kept = 0
+    block = sample_rate * BLOCK_SECONDS
+    with open(dst_path, 'wb') as out:
+        for start, end in spans:
+            offset_map.trimmed_starts.append(kept / sample_rate)
+            offset_map.original_starts.append(start / sample_rate)
+            for block_start in range(start, end, block):
+                audio[block_start:min(block_start + block, end)].tofile(out)
+            kept += end - start
+
+    stats = {
+        "original_seconds": len(audio) / sample_rate,
+        "kept_seconds": kept / sample_rate,
+        "spans": len(spans),
+        "elapsed_seconds": time.perf_counter() - start_time
+    }
+    del audio
+    return offset_map, stats
+
+
+def remap_response_times(response, offset_map):
+    """Shift every start/end in a Deepgram response from trimmed time back to recording time."""
+    def remap(item):
+        for key in ("start", "end"):
+            if key in item:
+                item[key] = offset_map.to_original(item[key])
+
+    try:
+        alternatives = [alt for channel in response["results"]["channels"] for alt in channel["alternatives"]]
+    except (KeyError, TypeError):
+        return response
+    for alternative in alternatives:
+        for word in alternative.get("words", []):
+            remap(word)
+        for paragraph in (alternative.get("paragraphs") or {}).get("paragraphs", []):
+            remap(paragraph)
+            for sentence in paragraph.get("sentences", []):
+                remap(sentence)
+    for utterance in response["results"].get("utterances") or []:
+        remap(utterance)
+    return response
+
+
+def benchmark(minutes=60):
+    """Measure trimming throughput on a synthetic recording with lobby and after-meeting silence."""
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "meeting.pcm")
+        dst = os.path.join(tmp, "trimmed.pcm")
+        with open(src, 'wb') as audio:
+            for minute in range(minutes):
+                t = np.arange(SAMPLE_RATE * 60) / SAMPLE_RATE
+                signal = rng.normal(0, 20, len(t))
+                # Silent lobby for the first 10%, silence after everyone left for the last 20%
+                if 0.1 * minutes <= minute < 0.8 * minutes:
+                    talking = np.sin(2 * np.pi * t / 17) > -0.3
+                    signal += talking * 4000 * np.sin(2 * np.pi * 220 * t)
+                signal.astype('<i2').tofile(audio)
+
+        offset_map, stats = trim_silence(src, dst)
+        size_mb = os.path.getsize(src) / 1e6
+        print(f"input:       {stats['original_seconds'] / 60:.0f} min ({size_mb:.0f} MB)")
+        print(f"kept:        {stats['kept_seconds'] / 60:.1f} min in {stats['spans']} spans")
+        print(f"elapsed:     {stats['elapsed_seconds']:.2f}s")
+        print(f"throughput:  {size_mb / stats['elapsed_seconds']:.0f} MB/s, "
+              f"{stats['original_seconds'] / stats['elapsed_seconds']:.0f}x realtime")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark silence trimming")
+    arg_parser.add_argument("--minutes", type=int, default=60, help="length of the synthetic recording")
+    benchmark(arg_parser.parse_args().minutes)
@@ -1,26 +1,115 @@
+import asyncio
 import logging
 import os
 import time
 from dotenv import load_dotenv
-import subprocess
 import pwd
 import signal
 import uuid
-import requests
+from .streaming import StreamingTranscriber
+from .transcribe import TranscriptionError, transcribe_chunked
+from .vad import remap_response_times, trim_silence
 
 # Load environment variables
 load_dotenv()
 
 client_id = os.getenv('ZOOM_CLIENT_ID')
 client_secret = os.getenv('ZOOM_CLIENT_SECRET')
-deepgram_api_key = os.getenv('DEEPGRAM')
+
+# "batch" uploads the recording after the meeting, "streaming" transcribes it live
+ZOOM_TRANSCRIPTION_MODE = os.getenv("ZOOM_TRANSCRIPTION_MODE", "batch")
+# Drop long silences (lobby, empty room before --leave-time) before transcription
+TRIM_SILENCE = os.getenv("TRIM_SILENCE", "true").lower() == "true"
+# How long to wait after each of SIGINT and SIGTERM before escalating
+ZOOM_STOP_TIMEOUT_SECONDS = int(os.getenv("ZOOM_STOP_TIMEOUT_SECONDS", "30"))
 
 # Logger
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')  # Set to DEBUG to capture more detailed logs
 
-def join_zoom_meeting(meeting_url, end_time):
+
+async def stop_process(process, timeout=ZOOM_STOP_TIMEOUT_SECONDS):
+    """Stop the zoomsdk politely: SIGINT so it leaves the meeting and flushes audio, then SIGTERM, then SIGKILL."""
+    for stop in (lambda: process.send_signal(signal.SIGINT), process.terminate):
+        if process.returncode is not None:
+            return
+        try:
+            stop()
+        except ProcessLookupError:
+            return
+        try:
+            await asyncio.wait_for(process.wait(), timeout)
+            return
+        except asyncio.TimeoutError:
+            logging.warning("Process did not exit in time, escalating.")
+    if process.returncode is None:
+        logging.warning("Process did not terminate in time, killing it.")
+        process.kill()
+        await process.wait()
+
+
+async def _log_stderr(stream):
+    # Drain stderr as it arrives so a chatty process can never block on a full pipe
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+        try:
+            logging.error(f"Error output from process: {line.decode('utf-8').strip()}")
+        except UnicodeDecodeError:
+            pass
+
+
+async def transcribe_pcm_file(audio_file_path):
+    """
+    Transcribe the recording and return a Deepgram-shaped response.
+
+    Raises TranscriptionError if any part of the recording could not be
+    transcribed, in which case the recording must not be deleted.
+    """
+    source_path = audio_file_path
+    offset_map = None
+    if TRIM_SILENCE:
+        trimmed_path = audio_file_path + ".trimmed"
+        try:
+            offset_map, stats = await asyncio.to_thread(trim_silence, audio_file_path, trimmed_path)
+            logging.info(f"Kept {stats['kept_seconds']:.0f}s of {stats['original_seconds']:.0f}s of audio "
+                         f"in {stats['spans']} spans ({stats['elapsed_seconds']:.2f}s)")
+            source_path = trimmed_path
+        except Exception as e:
+            logging.error(f"Failed to trim silence, transcribing the full recording: {e}")
+            offset_map = None
+            if os.path.exists(trimmed_path):
+                os.remove(trimmed_path)
+
+    try:
+        # Chunks are resampled/compressed, uploaded in parallel and retried individually
+        transcript = await transcribe_chunked(source_path)
+    finally:
+        if source_path != audio_file_path and os.path.exists(source_path):
+            os.remove(source_path)
+
+    # Put transcript times back on the original recording's timeline
+    if offset_map is not None:
+        remap_response_times(transcript, offset_map)
+    return transcript
+
+
+async def join_zoom_meeting_async(meeting_url, end_time):
+    """
+    Run the zoomsdk bot for one meeting without blocking the event loop.
+
+    The meeting is left when the host ends it, when `end_time` minutes have
+    passed, or when the calling task is cancelled; in every case the process
+    is stopped with SIGINT -> SIGTERM -> SIGKILL escalation.
+    """
     logging.debug("join_zoom_meeting function called")
     transcript = ""
+    audio_file_path = None
+    keep_audio = False
+    process = None
+    stderr_task = None
+    stream_task = None
+    stop_streaming = asyncio.Event()
     try:
         # Check if the zoomsdk directory exists
         zoomsdk_path = '/lib/zoomsdk'
@@ -57,105 +146,102 @@ def join_zoom_meeting(meeting_url, end_time):
         ]
         logging.info(f"Running command: {' '.join(command)}")
 
-        process = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=False,
-            bufsize=0,
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
             preexec_fn=lambda: os.setgid(zoomuser_gid) or os.setuid(zoomuser_uid)
         )
+        stderr_task = asyncio.create_task(_log_stderr(process.stderr))
+
+        if ZOOM_TRANSCRIPTION_MODE == "streaming":
+            # Transcribe the recording while it is being written
+            stream_task = asyncio.create_task(StreamingTranscriber().run(audio_file_path, stop_streaming))
 
         logging.info('Process started, waiting for output...')
         start_time = time.time()
+        deadline = start_time + end_time * 60
         last_time_check = start_time
 
-        # Read stdout line-by-line in a loop (if you still want real-time logs)
         while True:
-            line = process.stdout.readline()
-            # If line is empty and the process has ended, break out
-            if not line and process.poll() is not None:
+            time_left = deadline - time.time()
+            if time_left <= 0:
+                logging.info("Meeting time is over. Exiting...")
+                break
+            try:
+                # Wake up at least every 10 seconds to report the time left
+                line = await asyncio.wait_for(process.stdout.readline(), min(time_left, 10))
+            except asyncio.TimeoutError:
+                line = None
+            if line == b"":
+                # EOF: the process has exited on its own
                 break
-            if line.strip():
+            if line and line.strip():
                 try:
                     decoded_line = line.decode('utf-8').strip()
                     if "⏳ Writing" not in decoded_line:
                         logging.info(decoded_line)
                     if "✅ meeting ended" in decoded_line:
                         logging.info("Meeting ended by host. Exiting...")
-                        process.send_signal(signal.SIGINT)  # Send Ctrl+C
                         break
                 except UnicodeDecodeError:
                     pass
 
             current_time = time.time()
             if current_time - last_time_check >= 10:
-                time_left = end_time * 60 - (current_time - start_time)
+                time_left = deadline - current_time
                 if time_left > 0:
                     logging.info(f"Time left: {int(time_left // 60)} minutes and {int(time_left % 60)} seconds")
                 last_time_check = current_time
 
-            # Check meeting time
-            if current_time - start_time >= end_time * 60:
-                logging.info("Meeting time is over. Exiting...")
-                process.send_signal(signal.SIGINT)  # Send Ctrl+C
-                break
+        await stop_process(process)
+        logging.info("Subprocess terminated after meeting time ended or host ended the meeting.")
 
-        # Terminate the subprocess
-        if process.poll() is None:
-            process.terminate()
+        streamed = False
+        if stream_task is not None:
+            stop_streaming.set()
             try:
-                process.wait(timeout=30)
-            except subprocess.TimeoutExpired:
-                logging.warning("Process did not terminate in time, killing it.")
-                process.kill()
-                process.wait()
-            logging.info("Subprocess terminated after meeting time ended or host ended the meeting.")
-
-        _stdout_final, stderr_final = process.communicate(timeout=20)
-        if stderr_final:
-            try:
-                logging.error(f"Error output from process: {stderr_final.decode('utf-8')}")
-            except UnicodeDecodeError:
-                pass
+                transcript = await stream_task
+                streamed = True
+            except Exception as e:
+                logging.error(f"Streaming transcription failed, falling back to file upload: {e}")
 
         # Use Deepgram to generate the transcript
-        if os.path.exists(audio_file_path):
-            logging.info("Sending raw PCM audio file to Deepgram for transcription")
-            with open(audio_file_path, 'rb') as audio:
-                url = "https://api.deepgram.com/v1/listen"
-                headers = {
-                    'Authorization': f'Token {deepgram_api_key}',
-                    'Content-Type': 'audio/raw'
-                }
-                params = {
-                    "encoding": "linear16",  # 16-bit signed PCM
-                    "channels": 1,  # Mono audio
-                    "sample_rate": 32000,  # Sample rate in Hz
-                    "paragraphs": "true",
-                    "diarize": "true"
-                }
-                try:
-                    response = requests.post(url, headers=headers, params=params, data=audio)
-                    print(f"Status Code: {response.status_code}")
-                    response.raise_for_status() 
-                    transcript = response.json()
-                except requests.exceptions.HTTPError as http_err:
-                    print(f"HTTP error occurred: {http_err} - {response.text}")
-                except Exception as err:
-                    print(f"An error occurred while getting transcript from Deepgram: {err}")
-
+        if not streamed and os.path.exists(audio_file_path):
+            try:
+                transcript = await transcribe_pcm_file(audio_file_path)
+            except TranscriptionError as e:
+                # Keep the recording so it can be transcribed again later
+                keep_audio = True
+                logging.error(f"Transcription failed, keeping {audio_file_path}: {e}")
+
+    except asyncio.CancelledError:
+        logging.info("Meeting task cancelled, stopping the zoomsdk")
+        if process is not None:
+            await asyncio.shield(stop_process(process))
+        raise
     except Exception as e:
         logging.error(f"Unexpected error during meeting join: {e}")
+        if process is not None:
+            await stop_process(process)
     finally:
+        if stderr_task is not None:
+            stderr_task.cancel()
+        if stream_task is not None and not stream_task.done():
+            stream_task.cancel()
         logging.info("Exiting the meeting process")
 
-    # We can add the upload to s3 in this place.
-    if os.path.exists(audio_file_path):
-        try:
-            os.remove(audio_file_path)
-            logging.info(f"Audio file {audio_file_path} deleted successfully.")
-        except Exception as e:
-            logging.error(f"Failed to delete audio file {audio_file_path}: {e}")
+        # We can add the upload to s3 in this place.
+        if audio_file_path and os.path.exists(audio_file_path) and not keep_audio:
+            try:
+                os.remove(audio_file_path)
+                logging.info(f"Audio file {audio_file_path} deleted successfully.")
+            except Exception as e:
+                logging.error(f"Failed to delete audio file {audio_file_path}: {e}")
 
     return transcript
+
+
+def join_zoom_meeting(meeting_url, end_time):
+    """Blocking wrapper around `join_zoom_meeting_async` for callers without an event loop."""
+    return asyncio.run(join_zoom_meeting_async(meeting_url, end_time))